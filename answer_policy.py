@@ -0,0 +1,151 @@
+"""Deciding whether a query result needs the LLM to be answered.
+
+Restating a count or a short GROUP BY result does not need a second model call. The policy
+(``SQLBOT_ANSWER_POLICY``) picks one of three paths per turn:
+
+- ``llm``: every answer is written by the LLM, as before;
+- ``auto`` (default): scalar, single-row, small tabular and time-series results get a
+  ``fast`` deterministic answer (text, table or chart); anything else goes to the LLM;
+- ``lazy``: like ``auto``, but the other results are ``deferred``: they get a short
+  deterministic answer and the LLM only runs if the user asks for an explanation.
+
+Questions asking for interpretation ("why", "explain", ...) always go to the LLM, unless
+the policy is ``lazy``.
+"""
+import datetime
+import os
+import re
+from decimal import Decimal
+
+
+POLICY = os.getenv("SQLBOT_ANSWER_POLICY", "auto")
+MAX_RECORD_COLUMNS = 6
+MAX_TABLE_ROWS = 50
+MAX_TABLE_COLUMNS = 6
+MAX_SERIES_POINTS = 500
+
+_INTERPRET_RE = re.compile(
+    r"\b(why|explain\w*|interpret\w*|insights?|recommend\w*|suggest\w*|should|meaning|implications?|"
+    r"summari[sz]e\w*)\b",
+    re.I,
+)
+_TIME_COLUMN_RE = re.compile(r"(^|_)(year|month|date|day|week|quarter|time|period)s?($|_)", re.I)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _is_numeric(values: list) -> bool:
+    present = [v for v in values if v is not None]
+    return bool(present) and all(_is_number(v) for v in present)
+
+
+def _is_time_column(column: str, values: list) -> bool:
+    if _TIME_COLUMN_RE.search(column):
+        return True
+    present = [v for v in values if v is not None]
+    return bool(present) and all(isinstance(v, (datetime.date, datetime.datetime)) for v in present)
+
+
+# Function to name the shape of a query result: empty, scalar, record, timeseries, table or complex
+def classify(result) -> str:
+    columns = getattr(result, "columns", None)
+    if columns is None:
+        return "complex"
+    if result.row_count == 0:
+        return "empty"
+    if result.truncated:
+        return "complex"
+    if result.row_count == 1:
+        if len(columns) == 1:
+            return "scalar"
+        if len(columns) <= MAX_RECORD_COLUMNS:
+            return "record"
+    x, ys = columns[0], columns[1:]
+    if (1 <= len(ys) <= 3 and 2 <= result.row_count <= MAX_SERIES_POINTS
+            and _is_time_column(x, result.data[x]) and len(set(result.data[x])) == result.row_count
+            and all(_is_numeric(result.data[y]) for y in ys)):
+        return "timeseries"
+    if result.row_count <= MAX_TABLE_ROWS and len(columns) <= MAX_TABLE_COLUMNS:
+        return "table"
+    return "complex"
+
+
+# Function to pick the answer path for a turn: returns (path, kind) with path "fast", "llm" or "deferred"
+def choose_path(question: str, result, policy: str = POLICY) -> tuple:
+    kind = classify(result)
+    if policy == "llm":
+        return "llm", kind
+    if policy == "lazy":
+        return ("fast" if kind != "complex" else "deferred"), kind
+    if kind == "complex" or _INTERPRET_RE.search(question):
+        return "llm", kind
+    return "fast", kind
+
+
+def _label(column: str) -> str:
+    return column.replace("_", " ").strip()
+
+
+# Function to format a value for an answer: thousands separators (not for years and the like),
+# at most 2 decimals, ISO dates
+def format_value(value, column: str = "") -> str:
+    if value is None:
+        return "none"
+    if isinstance(value, Decimal):
+        value = int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, bool) or (isinstance(value, int) and _TIME_COLUMN_RE.search(column)):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        return f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _cell(value, column: str) -> str:
+    return format_value(value, column).replace("|", "\\|").replace("\n", " ")
+
+
+# Function to write the first max_rows rows of a result as a markdown table
+def markdown_table(result, max_rows: int = MAX_TABLE_ROWS) -> str:
+    columns = result.columns
+    lines = [
+        "| " + " | ".join(_label(c).replace("|", "\\|") for c in columns) + " |",
+        "|" + "|".join(" ---: " if _is_numeric(result.data[c]) else " --- " for c in columns) + "|",
+    ]
+    for i in range(min(result.row_count, max_rows)):
+        lines.append("| " + " | ".join(_cell(result.data[c][i], c) for c in columns) + " |")
+    if result.row_count > max_rows:
+        lines.append(f"\nFirst {max_rows} of {result.row_count} rows.")
+    return "\n".join(lines)
+
+
+# Function to write the deterministic answer for a result (the chat message text); tables and
+# time series include their rows, so the text stands on its own (chat history, batch output)
+def render_text(kind: str, result) -> str:
+    if kind == "empty":
+        return "The query returned no rows."
+    columns = result.columns
+    if kind == "scalar":
+        label = _label(columns[0])
+        return f"{label[:1].upper()}{label[1:]}: **{format_value(result.data[columns[0]][0], columns[0])}**"
+    if kind == "record":
+        return "\n".join(f"- **{_label(column)}**: {format_value(result.data[column][0], column)}" for column in columns)
+    if kind == "timeseries":
+        x, y = columns[0], columns[1]
+        xs, ys = result.data[x], result.data[y]
+        points = [(v, t) for t, v in zip(xs, ys) if v is not None]
+        text = (f"{_label(y)[:1].upper()}{_label(y)[1:]} by {_label(x)}, {result.row_count} points "
+                f"from {format_value(xs[0], x)} to {format_value(xs[-1], x)}.")
+        if points:
+            high, low = max(points, key=lambda p: p[0]), min(points, key=lambda p: p[0])
+            text += (f" Highest: **{format_value(high[0], y)}** ({format_value(high[1], x)}),"
+                     f" lowest: **{format_value(low[0], y)}** ({format_value(low[1], x)}).")
+        return f"{text}\n\n{markdown_table(result)}"
+    if kind == "table":
+        return f"The query returned {result.row_count} rows:\n\n{markdown_table(result)}"
+    return f"The query returned {result.describe_rows()}."
@@ -0,0 +1,49 @@
+"""A process-wide asyncio event loop for running the async pipeline from sync code.
+
+Streamlit runs each session's script in its own thread. Rather than starting a new event
+loop per turn, every session submits its coroutines to one loop running in a background
+thread, so async clients (HTTP connection pools, async DB engines) live on a single loop
+and many turns can wait on network I/O concurrently.
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+
+_loop = None
+_lock = threading.Lock()
+
+
+# Function to get the shared event loop, starting its thread on first use
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="sqlbot-event-loop", daemon=True).start()
+        return _loop
+
+
+# Function to schedule a coroutine on the shared loop and get a concurrent.futures.Future for it
+def run_async(coro) -> concurrent.futures.Future:
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+# Function to iterate an async generator from sync code, one item at a time.
+# If the consumer stops early (e.g. Streamlit reruns because the user sent a new message),
+# the step in flight is cancelled and the async generator is closed.
+def iterate_async(agen):
+    future = None
+    try:
+        while True:
+            future = run_async(agen.__anext__())
+            try:
+                item = future.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        if future is not None and not future.done():
+            future.cancel()
+            concurrent.futures.wait([future], timeout=5)
+        run_async(agen.aclose())
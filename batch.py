@@ -0,0 +1,207 @@
+"""Headless batch mode: answer a JSONL file of questions through the same pipeline as the apps.
+
+    python batch.py questions.jsonl --app main --uri mysql+pymysql://user:pw@host:3306/fda \\
+        --output answers.jsonl --concurrency 4 --llm-calls-per-minute 60
+
+Each input line is a JSON object; the question is read from ``--field`` (``question`` by
+default, falling back to ``body`` and ``title``) and its id from ``id`` or ``request_id``
+(the line number otherwise). Every answered question is appended to the output file
+right away, so a crashed run picks up where it stopped when started again.
+
+A question is one turn of ``SQLPipeline.astream``, so it is guarded, repaired, routed and
+traced like a chat turn; its record is built from the turn's events and trace. With
+``--no-cache`` every question gets freshly written SQL run on the database, bypassing the
+SQL and result caches the apps share.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import time
+
+import openai
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackHandler
+from sqlalchemy.exc import DBAPIError
+
+from connection_manager import get_database
+from pipeline import get_pipeline
+
+
+# Errors worth retrying: the request may well succeed a moment later
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class RateLimiter:
+    """Spaces out LLM calls so that at most ``calls_per_minute`` start in any minute."""
+
+    def __init__(self, calls_per_minute: float):
+        self.interval = 60.0 / calls_per_minute if calls_per_minute else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimitCallback(AsyncCallbackHandler):
+    """Makes every LLM call of a turn wait for the rate limiter before it starts."""
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs):
+        await self.limiter.acquire()
+
+
+# Function to tell whether an error is transient (network, rate limit, lost DB connection)
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+# Function to run a turn, retrying transient errors with exponential backoff and jitter
+async def with_retries(stage, retries: int):
+    for attempt in range(retries + 1):
+        try:
+            return await stage()
+        except Exception as error:
+            if attempt == retries or not is_transient(error):
+                raise
+            await asyncio.sleep(min(30.0, 2 ** attempt) * (0.5 + random.random()))
+
+
+# Function to answer one question as a pipeline turn and return its output record with per-stage timings
+async def answer_question(pipeline, item: dict, limiter: RateLimiter, retries: int) -> dict:
+    record = {"id": item["id"], "question": item["question"]}
+    callbacks = [RateLimitCallback(limiter)]
+    started = time.perf_counter()
+    stage = "sql"
+
+    async def turn():
+        nonlocal stage
+        # A retry starts the turn over, so start the record over too
+        record.update(sql=None, repairs=0, row_count=None, answer=None, timings={})
+        stage, answer = "sql", []
+        async for kind, payload in pipeline.astream(item["question"], [], callbacks=callbacks):
+            if kind == "sql":
+                record["sql"], stage = payload, "query"
+            elif kind == "repair":
+                record["sql"] = payload[1]
+                record["repairs"] += 1
+            elif kind == "result":
+                record["row_count"], record["truncated"], stage = payload.row_count, payload.truncated, "answer"
+            elif kind == "path":
+                record["answer_path"] = payload["path"]
+            elif kind == "token":
+                answer.append(payload)
+            elif kind == "trace":
+                record["timings"] = {name: values["seconds"] for name, values in payload["stages"].items()}
+                record["cost"] = round(sum(values.get("cost", 0) for values in payload["stages"].values()), 6)
+        record["answer"] = "".join(answer)
+
+    try:
+        await with_retries(turn, retries)
+        record["status"] = "ok"
+    except Exception as error:
+        record["status"] = "error"
+        record["error"] = f"{stage}: {type(error).__name__}: {error}"
+    record["timings"]["total"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+# Function to read the questions to ask from a JSONL file
+def read_questions(path: str, field: str) -> list:
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            question = data.get(field) or data.get("body") or data.get("title")
+            if not question:
+                raise ValueError(f"{path}:{line_number}: no '{field}' in {line.strip()[:80]}")
+            item_id = data.get("id") or data.get("request_id") or str(line_number)
+            questions.append({"id": str(item_id), "question": question})
+    return questions
+
+
+# Function to read the ids already answered in a previous run of the same output file
+def read_checkpoint(path: str) -> set:
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash; that question is simply asked again
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+    return done
+
+
+async def run_batch(args) -> dict:
+    app = importlib.import_module(args.app)
+    db = get_database(args.uri)
+    pipeline = get_pipeline(db, app.SQL_TEMPLATE, app.ANSWER_TEMPLATE, use_cache=not args.no_cache,
+                            seeds=app.SEED_EXAMPLES)
+
+    done = read_checkpoint(args.output)
+    pending = [item for item in read_questions(args.input, args.field) if item["id"] not in done]
+    limiter = RateLimiter(args.llm_calls_per_minute)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    write_lock = asyncio.Lock()
+    counts = {"skipped": len(done), "ok": 0, "error": 0}
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        async def worker(item):
+            async with semaphore:
+                record = await answer_question(pipeline, item, limiter, args.retries)
+            async with write_lock:
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                counts[record["status"]] += 1
+            print(f"[{record['status']}] {record['id']} ({record['timings']['total']}s)", flush=True)
+
+        await asyncio.gather(*(worker(item) for item in pending))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions without the Streamlit UI.")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("--output", default="answers.jsonl", help="JSONL file to append answers to (checkpoint)")
+    parser.add_argument("--app", default="main", choices=["app", "main", "web_sql_bot"],
+                        help="entry point whose prompts to use")
+    parser.add_argument("--uri", default=os.getenv("SQLBOT_DATABASE_URI"), help="SQLAlchemy database URI")
+    parser.add_argument("--field", default="question", help="JSON field holding the question")
+    parser.add_argument("--concurrency", type=int, default=4, help="questions in flight at once")
+    parser.add_argument("--llm-calls-per-minute", type=float, default=60, help="0 disables rate limiting")
+    parser.add_argument("--retries", type=int, default=3, help="retries per question for transient errors")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="write and run fresh SQL for every question, bypassing the SQL and result caches")
+    args = parser.parse_args()
+    if not args.uri:
+        parser.error("--uri or SQLBOT_DATABASE_URI is required")
+
+    load_dotenv()
+    counts = asyncio.run(run_batch(args))
+    print(f"done: {counts['ok']} answered, {counts['error']} failed, {counts['skipped']} already answered")
@@ -0,0 +1,84 @@
+"""Generated SQLite stand-ins for the MySQL databases the apps are pointed at.
+
+``suicides`` mirrors the ``suicides_data`` table used by app.py and web_sql_bot.py, and
+``fda`` mirrors the ``table1``/``table2`` pair joined on ``application_number`` in
+main.py. Data is random but deterministic for a given seed and size.
+"""
+import datetime
+import os
+import random
+import sqlite3
+
+
+STATES = [
+    "Andhra Pradesh", "Assam", "Bihar", "Delhi", "Gujarat", "Karnataka", "Kerala", "Maharashtra",
+    "Punjab", "Rajasthan", "Tamil Nadu", "Uttar Pradesh", "West Bengal",
+]
+TYPE_CODES = {
+    "Causes": ["Family Problems", "Illness", "Bankruptcy", "Love Affairs", "Unemployment"],
+    "Means_adopted": ["By Hanging", "By Drowning", "By Consuming Insecticides", "By Fire/Self Immolation"],
+    "Professional_Profile": ["Farming/Agriculture Activity", "House Wife", "Student", "Unemployed"],
+}
+AGE_GROUPS = ["0-14", "15-29", "30-44", "45-59", "60+"]
+SPONSORS = ["PFIZER", "NOVARTIS", "MERCK", "SANOFI", "TEVA", "MYLAN", "SANDOZ", "ASTRAZENECA", "GSK", "ABBVIE"]
+SUBMISSION_TYPES = ["ORIG", "SUPPL", "LABELING", "MANUF"]
+
+
+# Function to generate the suicides_data table with the given number of rows
+def build_suicides(path: str, rows: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE IF EXISTS suicides_data")
+        conn.execute(
+            "CREATE TABLE suicides_data (State TEXT, Year INTEGER, Type_code TEXT, Type TEXT,"
+            " Gender TEXT, Age_group TEXT, Total INTEGER)"
+        )
+        data = []
+        for _ in range(rows):
+            type_code = rng.choice(list(TYPE_CODES))
+            data.append((
+                rng.choice(STATES), rng.randint(2001, 2012), type_code, rng.choice(TYPE_CODES[type_code]),
+                rng.choice(["Male", "Female"]), rng.choice(AGE_GROUPS), rng.randint(0, 500),
+            ))
+        conn.executemany("INSERT INTO suicides_data VALUES (?, ?, ?, ?, ?, ?, ?)", data)
+    return path
+
+
+# Function to generate table1 (applications) and table2 (submissions) with the given number of rows
+def build_fda(path: str, rows: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    applications = max(1, rows // 4)
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE IF EXISTS table1")
+        conn.execute("DROP TABLE IF EXISTS table2")
+        conn.execute(
+            "CREATE TABLE table1 (application_number TEXT PRIMARY KEY, brand_name TEXT, generic_name TEXT,"
+            " sponsor_name TEXT, dosage_form TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE table2 (application_number TEXT, submission_type TEXT, submission_number INTEGER,"
+            " submission_status TEXT, submission_status_date TEXT)"
+        )
+        conn.executemany("INSERT INTO table1 VALUES (?, ?, ?, ?, ?)", [
+            (f"NDA{i:06d}", f"BRAND{rng.randint(1, applications // 2 + 1)}", f"generic{i % 97}",
+             rng.choice(SPONSORS), rng.choice(["TABLET", "CAPSULE", "INJECTION", "SOLUTION"]))
+            for i in range(applications)
+        ])
+        start = datetime.date(2000, 1, 1)
+        conn.executemany("INSERT INTO table2 VALUES (?, ?, ?, ?, ?)", [
+            (f"NDA{rng.randrange(applications):06d}", rng.choice(SUBMISSION_TYPES), i, "AP",
+             (start + datetime.timedelta(days=rng.randrange(8000))).isoformat())
+            for i in range(rows)
+        ])
+    return path
+
+
+DATASETS = {"suicides": build_suicides, "fda": build_fda}
+
+
+# Function to build a dataset in a directory (once per size and seed) and return its SQLAlchemy URI
+def dataset_uri(name: str, directory: str, rows: int, seed: int = 0) -> str:
+    path = os.path.join(directory, f"{name}-{rows}-{seed}.sqlite3")
+    if not os.path.exists(path):
+        DATASETS[name](path, rows, seed)
+    return f"sqlite:///{path}"
@@ -0,0 +1,83 @@
+"""A deterministic, scripted stand-in for ``ChatOpenAI`` with configurable latency.
+
+SQL prompts are answered from a question -> SQL script (by default the seed examples of
+the database), every other prompt with a fixed sentence streamed word by word. Each
+call records its estimated prompt and completion tokens in ``calls``. With ``error_rate``
+the model stands in for a weaker one: that fraction of the questions (always the same
+ones) gets a query the database rejects.
+"""
+import asyncio
+import re
+import time
+import zlib
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from text_index import estimate_tokens
+
+
+_QUESTION_RE = re.compile(r"Question:\s*(.+)")
+
+ANSWER = "Here is what the data shows: the query returned the rows listed above, grouped as you asked."
+
+
+# Function to turn few-shot examples (see example_store) into a question -> SQL script
+def script_from_examples(examples: list) -> dict:
+    return {example["question"]: example["sql"] for example in examples}
+
+
+class ScriptedChatModel(BaseChatModel):
+    script: dict = Field(default_factory=dict)
+    latency: float = 0.5
+    token_latency: float = 0.0
+    error_rate: float = 0.0
+    calls: list = Field(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        if "SQL Response:" in prompt:
+            kind, text = "answer", ANSWER
+        elif "SQL Query:" in prompt:
+            questions = _QUESTION_RE.findall(prompt)
+            question = questions[-1].strip() if questions else ""
+            kind, text = "sql", self.script.get(question, "SELECT 1;")
+            if zlib.crc32(question.encode()) % 1000 < self.error_rate * 1000:
+                text = "SELECT missing_column FROM missing_table;"
+        else:
+            # e.g. the conversation summary prompt
+            kind, text = "other", ANSWER
+        self.calls.append({"kind": kind, "prompt_tokens": estimate_tokens(prompt),
+                           "completion_tokens": estimate_tokens(text)})
+        return text
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any):
+        time.sleep(self.latency)
+        for word in re.findall(r"\S+\s*", self._reply(messages)):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for word in re.findall(r"\S+\s*", self._reply(messages)):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
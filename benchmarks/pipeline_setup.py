@@ -0,0 +1,45 @@
+"""Microbenchmark: per-question setup cost before and after caching the pipeline.
+
+Run from the repository root with ``python -m benchmarks.pipeline_setup``. No network
+calls are made; only object construction is timed.
+"""
+import argparse
+import os
+import tempfile
+import timeit
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+
+from connection_manager import get_database
+from main import ANSWER_TEMPLATE, SQL_TEMPLATE
+from pipeline import MODEL, get_pipeline
+
+
+# Function to build what get_response() used to build on every question
+def legacy_setup():
+    ChatPromptTemplate.from_template(SQL_TEMPLATE)
+    ChatOpenAI(model=MODEL)
+    ChatPromptTemplate.from_template(ANSWER_TEMPLATE)
+    ChatOpenAI(model=MODEL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200, help="setups per measurement")
+    args = parser.parse_args()
+
+    # The clients are never used to call the API, so any key will do
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_database(f"sqlite:///{os.path.join(tmp, 'bench.db')}", read_only=False)
+        get_pipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE)
+
+        legacy = timeit.timeit(legacy_setup, number=args.number) / args.number
+        cached = timeit.timeit(lambda: get_pipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE),
+                               number=args.number) / args.number
+        db._engine.dispose()
+
+    print(f"rebuild per question: {legacy * 1e3:8.3f} ms")
+    print(f"cached pipeline:      {cached * 1e3:8.3f} ms")
+    print(f"speedup:              {legacy / cached:8.1f}x")
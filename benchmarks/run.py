@@ -0,0 +1,211 @@
+"""Offline benchmark of the chat pipelines of app.py, main.py and web_sql_bot.py.
+
+Every app runs against a generated SQLite stand-in of its database and a scripted fake
+chat model, so no MySQL server or OpenAI key is needed and runs are repeatable:
+
+    python -m benchmarks.run --rows 100000 --sessions 8 --turns 6 --latency 0.2
+    python -m benchmarks.run --save-baseline bench_baseline.json
+    python -m benchmarks.run --baseline bench_baseline.json --tolerance 0.2
+    python -m benchmarks.run --cold --fast-latency 0.05 --fast-error-rate 0.3
+
+It reports p50/p95 latency per stage, prompt token counts, the peak Python memory and
+the throughput of N concurrent simulated sessions. ``--fast-latency`` adds a second fake
+model as the fast SQL tier (see ``model_router``) and reports how many SQL calls each tier
+made. Each app starts with empty SQL and result caches and no learned examples, so one app
+never answers from what another learned on the same dataset; ``--warm`` keeps them. With
+``--baseline`` the run fails (exit code 1) when a p95 latency or the throughput regresses by
+more than the tolerance.
+"""
+import argparse
+import asyncio
+import atexit
+import importlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Keep the benchmark's SQL cache away from the real one; must be set before importing it
+_cache_dir = tempfile.mkdtemp(prefix="sqlbot-bench-")
+atexit.register(shutil.rmtree, _cache_dir, ignore_errors=True)
+os.environ["SQLBOT_CACHE_DIR"] = _cache_dir
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from benchmarks.datasets import dataset_uri  # noqa: E402
+from benchmarks.fake_llm import ScriptedChatModel, script_from_examples  # noqa: E402
+from connection_manager import get_database  # noqa: E402
+from example_store import get_example_store, load_examples  # noqa: E402
+from memory import ConversationMemory  # noqa: E402
+from pipeline import get_pipeline  # noqa: E402
+from result_cache import result_cache  # noqa: E402
+from sql_cache import sql_cache  # noqa: E402
+
+
+APPS = {"app": "suicides", "main": "fda", "web_sql_bot": "suicides"}
+# Seed example files are named after the MySQL databases the datasets stand in for
+EXAMPLE_SETS = {"suicides": "sucides", "fda": "fda"}
+STAGES = ["sql", "query", "first_token", "answer", "total"]
+
+
+# Function to compute the p-th percentile of a list of numbers
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * p / 100
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+# Function to simulate one chat session asking its questions one after the other
+async def run_session(pipeline, questions: list, turns: int, offset: int, cold: bool) -> list:
+    chat_history = [AIMessage(content="Hello! I'm a SQL assistant. Ask me anything about your database.")]
+    memory = ConversationMemory()
+    timings = []
+    for turn in range(turns):
+        if cold:
+            sql_cache.clear()
+            result_cache.invalidate()
+        question = questions[(offset + turn) % len(questions)]
+        chat_history.append(HumanMessage(content=question))
+        started = time.perf_counter()
+        marks, answer = {}, []
+        async for kind, payload in pipeline.astream(question, chat_history, memory):
+            now = time.perf_counter() - started
+            if kind == "sql":
+                marks["sql"] = now
+            elif kind == "result":
+                marks["query"] = now - marks["sql"]
+            elif kind == "token":
+                marks.setdefault("first_token", now - marks["sql"] - marks["query"])
+                answer.append(payload)
+        marks["total"] = time.perf_counter() - started
+        marks["answer"] = marks["total"] - marks["sql"] - marks["query"]
+        chat_history.append(AIMessage(content="".join(answer)))
+        timings.append(marks)
+    return timings
+
+
+async def bench_app(name: str, args, directory: str) -> dict:
+    app = importlib.import_module(name)
+    db = get_database(dataset_uri(APPS[name], directory, args.rows, args.seed))
+    examples = get_example_store(db, EXAMPLE_SETS[APPS[name]])
+    if not args.warm:
+        sql_cache.clear()
+        result_cache.invalidate()
+        examples.clear_learned()
+    script = script_from_examples(load_examples(examples.seed_path))
+    llm = ScriptedChatModel(script=script, latency=args.latency, token_latency=args.token_latency)
+    fast_llm = None
+    if args.fast_latency is not None:
+        fast_llm = ScriptedChatModel(script=script, latency=args.fast_latency, token_latency=args.token_latency,
+                                     error_rate=args.fast_error_rate)
+    pipeline = get_pipeline(db, app.SQL_TEMPLATE, app.ANSWER_TEMPLATE, model="scripted-fake", llm=llm,
+                            fast_llm=fast_llm, seeds=EXAMPLE_SETS[APPS[name]])
+    pipeline.answer_policy = args.answer_policy
+    questions = list(llm.script)
+
+    started = time.perf_counter()
+    sessions = await asyncio.gather(*(
+        run_session(pipeline, questions, args.turns, offset, args.cold) for offset in range(args.sessions)
+    ))
+    elapsed = time.perf_counter() - started
+    turns = [marks for session in sessions for marks in session]
+
+    report = {"turns": len(turns), "throughput": len(turns) / elapsed}
+    for stage in STAGES:
+        values = [marks[stage] for marks in turns if stage in marks]
+        report[f"{stage}_p50"] = percentile(values, 50)
+        report[f"{stage}_p95"] = percentile(values, 95)
+    for kind in ["sql", "answer"]:
+        tokens = [call["prompt_tokens"] for call in llm.calls if call["kind"] == kind]
+        report[f"{kind}_prompt_tokens"] = statistics.mean(tokens) if tokens else 0
+    if fast_llm is not None:
+        report["fast_sql_calls"] = sum(call["kind"] == "sql" for call in fast_llm.calls)
+        report["strong_sql_calls"] = sum(call["kind"] == "sql" for call in llm.calls)
+    return report
+
+
+# Function to list the metrics that got worse than the baseline by more than the tolerance
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    failures = []
+    for name, report in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for stage in STAGES:
+            key = f"{stage}_p95"
+            if base.get(key) and report[key] > base[key] * (1 + tolerance):
+                failures.append(f"{name}: {key} {report[key] * 1e3:.1f} ms > baseline {base[key] * 1e3:.1f} ms")
+        if base.get("throughput") and report["throughput"] < base["throughput"] * (1 - tolerance):
+            failures.append(f"{name}: throughput {report['throughput']:.2f}/s < baseline {base['throughput']:.2f}/s")
+    return failures
+
+
+def print_report(results: dict):
+    header = f"{'app':<12} {'stage':<12} {'p50 ms':>9} {'p95 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, report in results.items():
+        for stage in STAGES:
+            print(f"{name:<12} {stage:<12} {report[stage + '_p50'] * 1e3:9.1f} {report[stage + '_p95'] * 1e3:9.1f}")
+        print(f"{name:<12} prompt tokens: sql {report['sql_prompt_tokens']:.0f}, "
+              f"answer {report['answer_prompt_tokens']:.0f}; throughput {report['throughput']:.2f} turns/s; "
+              f"peak memory {report['peak_memory_mb']:.1f} MB")
+        if "fast_sql_calls" in report:
+            print(f"{name:<12} SQL calls: fast model {report['fast_sql_calls']}, "
+                  f"strong model {report['strong_sql_calls']}")
+
+
+async def main(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="sqlbot-data-") as directory:
+        for name in args.apps:
+            tracemalloc.start()
+            results[name] = await bench_app(name, args, directory)
+            results[name]["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the chat pipelines offline.")
+    parser.add_argument("--apps", nargs="+", default=list(APPS), choices=list(APPS))
+    parser.add_argument("--rows", type=int, default=20_000, help="rows in the generated datasets")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent simulated sessions")
+    parser.add_argument("--turns", type=int, default=6, help="questions per session")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency per call, seconds")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="fake model delay per streamed token")
+    parser.add_argument("--fast-latency", type=float, help="add a fast SQL tier with this fake model latency")
+    parser.add_argument("--fast-error-rate", type=float, default=0.0,
+                        help="fraction of questions the fast tier writes failing SQL for")
+    parser.add_argument("--answer-policy", default="auto", choices=["llm", "auto", "lazy"],
+                        help="when the answer LLM call is made (see answer_policy)")
+    parser.add_argument("--cold", action="store_true", help="clear the SQL and result caches before every turn")
+    parser.add_argument("--warm", action="store_true",
+                        help="keep the caches and learned examples of the apps benchmarked before")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", help="write the results as a baseline to this JSON file")
+    parser.add_argument("--baseline", help="fail when results regress against this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print_report(results)
+    for path in filter(None, [args.json, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        if failures:
+            print("\n".join(["", "Regressions:"] + failures))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
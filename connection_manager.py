@@ -0,0 +1,207 @@
+"""One pooled engine per database, shared by every Streamlit session of the process.
+
+``get_database`` returns the same ``SQLDatabase`` (and so the same SQLAlchemy engine and
+connection pool) for every session that connects with the same URI, instead of building
+a new engine on each Connect click; only its table list is read again, so tables created
+since show up. Connections are read-only and every statement is stopped after
+``STATEMENT_TIMEOUT`` seconds, or after the longer timeout background jobs ask for with
+``connect_with_timeout``.
+"""
+import importlib.util
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, event
+
+from schema_cache import refresh_table_names
+
+
+POOL_SIZE = int(os.getenv("SQLBOT_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("SQLBOT_MAX_OVERFLOW", "10"))
+POOL_RECYCLE = int(os.getenv("SQLBOT_POOL_RECYCLE", "1800"))
+POOL_TIMEOUT = int(os.getenv("SQLBOT_POOL_TIMEOUT", "30"))
+# The bot only ever needs to read, so connections refuse writes unless this is turned off
+READ_ONLY = os.getenv("SQLBOT_READ_ONLY", "1") != "0"
+# Seconds a single statement may run before the database stops it (0 disables the timeout)
+STATEMENT_TIMEOUT = float(os.getenv("SQLBOT_STATEMENT_TIMEOUT", "30"))
+
+# Async SQLAlchemy driver to use for each backend, if installed: (module, drivername)
+_ASYNC_DRIVERS = {
+    "mysql": ("aiomysql", "mysql+aiomysql"),
+    "sqlite": ("aiosqlite", "sqlite+aiosqlite"),
+    "postgresql": ("asyncpg", "postgresql+asyncpg"),
+}
+
+_databases = {}
+_async_engines = {}
+_read_only_engines = set()
+_statement_timeouts = {}
+_lock = threading.Lock()
+
+
+# Function to make every pooled connection read-only as soon as it is opened
+def _set_read_only(engine):
+    dialect = engine.dialect.name
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if dialect == "mysql":
+            cursor.execute("SET SESSION TRANSACTION READ ONLY")
+        elif dialect == "sqlite":
+            cursor.execute("PRAGMA query_only = ON")
+        elif dialect == "postgresql":
+            cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        cursor.close()
+
+
+# Function to set the statement timeout of a session, in seconds (0 lifts it); execute runs one statement
+def _apply_statement_timeout(execute, dialect: str, timeout: float):
+    if dialect == "mysql":
+        try:
+            execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout * 1000)}")
+        except Exception:
+            # MariaDB spells it differently, in seconds
+            execute(f"SET SESSION max_statement_time = {timeout}")
+    elif dialect == "postgresql":
+        execute(f"SET statement_timeout = {int(timeout * 1000)}")
+
+
+# Function to stop statements that run longer than the timeout, in seconds
+def _set_statement_timeout(engine, timeout: float):
+    dialect = engine.dialect.name
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        if dialect == "sqlite":
+            # SQLite has no timeout setting: a progress handler aborts the statement past its deadline
+            if hasattr(dbapi_connection, "set_progress_handler"):
+                dbapi_connection.set_progress_handler(
+                    lambda: time.monotonic() > connection_record.info.get("deadline", float("inf")), 10_000
+                )
+            return
+        cursor = dbapi_connection.cursor()
+        _apply_statement_timeout(cursor.execute, dialect, timeout)
+        cursor.close()
+
+    if dialect == "sqlite":
+        @event.listens_for(engine, "before_cursor_execute")
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            limit = conn.info.get("statement_timeout", timeout)
+            conn.info["deadline"] = time.monotonic() + limit if limit else float("inf")
+
+
+# Function to take a pooled connection whose statements get another timeout, in seconds, for
+# background work such as building rollups; the usual timeout is set back before the pool gets it back
+@contextmanager
+def connect_with_timeout(db: SQLDatabase, timeout: float):
+    engine = db._engine
+    default = _statement_timeouts.get(id(engine))
+    with engine.connect() as conn:
+        if not default:
+            yield conn
+            return
+        dialect = engine.dialect.name
+        conn.info["statement_timeout"] = timeout
+        _apply_statement_timeout(conn.exec_driver_sql, dialect, timeout)
+        try:
+            yield conn
+        finally:
+            conn.info.pop("statement_timeout", None)
+            try:
+                _apply_statement_timeout(conn.exec_driver_sql, dialect, default)
+            except Exception:
+                # Never hand the pool a connection without its usual timeout
+                conn.invalidate()
+
+
+# Function to get the shared database for a URI, creating its engine and pool on first use
+def get_database(db_uri: str, read_only: bool = READ_ONLY, pool_size: int = POOL_SIZE,
+                 max_overflow: int = MAX_OVERFLOW, pool_recycle: int = POOL_RECYCLE,
+                 pool_pre_ping: bool = True, statement_timeout: float = STATEMENT_TIMEOUT) -> SQLDatabase:
+    key = (db_uri, read_only)
+    with _lock:
+        db = _databases.get(key)
+        created = db is None
+        if created:
+            engine_args = {"pool_pre_ping": pool_pre_ping, "pool_recycle": pool_recycle}
+            if not db_uri.startswith("sqlite"):
+                engine_args.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=POOL_TIMEOUT)
+            engine = create_engine(db_uri, **engine_args)
+            # Registered before SQLDatabase reflects the schema, so no connection escapes it
+            if read_only:
+                _set_read_only(engine)
+                _read_only_engines.add(id(engine))
+            if statement_timeout:
+                _set_statement_timeout(engine, statement_timeout)
+                _statement_timeouts[id(engine)] = statement_timeout
+            db = SQLDatabase(engine)
+            _databases[key] = db
+    if not created:
+        # A new connection used to reflect the schema again: keep seeing tables created since
+        refresh_table_names(db)
+    return db
+
+
+# Function to get an async engine for the same database, or None when no async driver is installed.
+# It mirrors the pool, read-only and timeout settings of the database's sync engine.
+def get_async_engine(db: SQLDatabase):
+    url = db._engine.url
+    driver = _ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None or importlib.util.find_spec(driver[0]) is None:
+        return None
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    key = id(db._engine)
+    with _lock:
+        engine = _async_engines.get(key)
+        if engine is None:
+            engine_args = {"pool_pre_ping": True, "pool_recycle": POOL_RECYCLE}
+            if url.get_backend_name() != "sqlite":
+                engine_args.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+            engine = create_async_engine(url.set(drivername=driver[1]), **engine_args)
+            if key in _read_only_engines:
+                _set_read_only(engine.sync_engine)
+            if key in _statement_timeouts:
+                _set_statement_timeout(engine.sync_engine, _statement_timeouts[key])
+            _async_engines[key] = engine
+        return engine
+
+
+# Function to report how busy each shared pool is
+def pool_stats() -> list:
+    stats = []
+    for (db_uri, read_only), db in list(_databases.items()):
+        pool = db._engine.pool
+        entry = {
+            "database": db._engine.url.render_as_string(hide_password=True),
+            "read_only": read_only,
+            "status": pool.status(),
+        }
+        if hasattr(pool, "checkedout"):
+            size = pool.size()
+            entry.update(
+                size=size,
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                utilization=pool.checkedout() / (size + max(pool._max_overflow, 0) or 1),
+            )
+        stats.append(entry)
+    return stats
+
+
+# Function to close every shared pool, e.g. when the server shuts down
+def dispose_all():
+    with _lock:
+        for db in _databases.values():
+            db._engine.dispose()
+        for engine in _async_engines.values():
+            engine.sync_engine.dispose()
+        _databases.clear()
+        _async_engines.clear()
+        _read_only_engines.clear()
+        _statement_timeouts.clear()
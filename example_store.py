@@ -0,0 +1,173 @@
+"""Few-shot examples for the SQL prompt, retrieved per question instead of hard-coded.
+
+Each app names its seed file of validated question/SQL pairs, ``examples/<seeds>.jsonl``
+with one ``{"question": ..., "sql": ...}`` object per line; without a name the database name
+is used. The store then grows by itself: queries that ran and returned rows are added as
+``executed`` examples, and the ones a user marks as good as ``approved`` examples, in
+``<SQLBOT_CACHE_DIR>/examples/<database>.jsonl``.
+For each question the prompt only gets the ``TOP_K`` most similar examples (BM25 over the
+example questions).
+A learned example that is learned again with the same SQL is not written twice, and the
+learned file is compacted to the examples kept when it is loaded.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_community.utilities import SQLDatabase
+
+from schema_cache import database_key
+from sql_cache import CACHE_DIR, normalize_question, question_context
+from text_index import BM25Index
+
+
+EXAMPLES_DIR = os.getenv("SQLBOT_EXAMPLES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples"))
+TOP_K = 3
+MAX_LEARNED = 500
+# Which example wins when two have the same question
+_SOURCE_RANK = {"executed": 0, "seed": 1, "approved": 2}
+
+_stores = {}
+_lock = threading.Lock()
+
+
+# Function to read examples from a JSONL file (missing files have no examples)
+def load_examples(path: str) -> list:
+    examples = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    example = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash
+                    continue
+                if example.get("question") and example.get("sql"):
+                    examples.append(example)
+    return examples
+
+
+class ExampleStore:
+    """Validated question/SQL pairs for one database, searchable by question."""
+
+    def __init__(self, seed_path: str = None, learned_path: str = None, max_learned: int = MAX_LEARNED):
+        self.seed_path = seed_path
+        self.learned_path = learned_path
+        self.max_learned = max_learned
+        self._lock = threading.Lock()
+        self._examples = OrderedDict()
+        self._index = None
+        self._ordered = []
+        for example in load_examples(seed_path) if seed_path else []:
+            self._add({**example, "source": "seed"})
+        learned = load_examples(learned_path) if learned_path else []
+        for example in learned:
+            self._add({**example, "source": example.get("source", "executed")})
+        if learned_path and os.path.exists(learned_path):
+            self._compact()
+
+    def __len__(self):
+        return len(self._examples)
+
+    def _add(self, example: dict) -> bool:
+        key = normalize_question(example["question"])
+        current = self._examples.get(key)
+        if current is not None and _SOURCE_RANK[current["source"]] > _SOURCE_RANK[example["source"]]:
+            return False
+        self._examples.pop(key, None)
+        self._examples[key] = example
+        self._index = None
+        learned = [k for k, e in self._examples.items() if e["source"] == "executed"]
+        for stale in learned[:max(0, len(learned) - self.max_learned)]:
+            del self._examples[stale]
+        return True
+
+    def _compact(self):
+        """Rewrite the learned file with the learned examples kept, if it holds anything else."""
+        kept = [example for example in self._examples.values() if example["source"] != "seed"]
+        with open(self.learned_path, encoding="utf-8") as f:
+            lines = sum(1 for line in f if line.strip())
+        if lines == len(kept):
+            return
+        tmp_path = f"{self.learned_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for example in kept:
+                f.write(json.dumps(example) + "\n")
+        os.replace(tmp_path, self.learned_path)
+
+    def add(self, question: str, sql: str, source: str = "executed") -> bool:
+        """Add an example and append it to the learned file; returns False if nothing new was added."""
+        example = {"question": question.strip(), "sql": sql.strip(), "source": source, "added_at": time.time()}
+        with self._lock:
+            current = self._examples.get(normalize_question(example["question"]))
+            # The same question answered by the same query again: already stored
+            if (current is not None and current["sql"] == example["sql"]
+                    and _SOURCE_RANK[current["source"]] >= _SOURCE_RANK[source]):
+                return False
+            if not self._add(example):
+                return False
+            if self.learned_path:
+                os.makedirs(os.path.dirname(self.learned_path), exist_ok=True)
+                with open(self.learned_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(example) + "\n")
+        return True
+
+    def clear_learned(self):
+        """Forget the learned examples and delete the learned file; the seeds are kept."""
+        with self._lock:
+            self._examples.clear()
+            for example in load_examples(self.seed_path) if self.seed_path else []:
+                self._add({**example, "source": "seed"})
+            self._index = None
+            if self.learned_path and os.path.exists(self.learned_path):
+                os.remove(self.learned_path)
+
+    def approve(self, question: str, sql: str) -> bool:
+        return self.add(question, sql, source="approved")
+
+    def record(self, question: str, sql: str, result, chat_history: list = None) -> bool:
+        """Learn from a query that ran: standalone questions whose query returned rows only."""
+        if getattr(result, "row_count", 1) == 0 or question_context(question, chat_history):
+            return False
+        return self.add(question, sql)
+
+    def search(self, question: str, k: int = TOP_K) -> list:
+        with self._lock:
+            if self._index is None:
+                self._ordered = list(self._examples.values())
+                self._index = BM25Index([example["question"] for example in self._ordered])
+            index, ordered = self._index, self._ordered
+        ranked = index.search(question, k * 2)
+        # Among equally relevant examples, prefer approved ones, then seeds
+        ranked.sort(key=lambda item: (-round(item[1], 6), -_SOURCE_RANK[ordered[item[0]]["source"]]))
+        return [ordered[i] for i, _ in ranked[:k]]
+
+    def format(self, question: str, k: int = TOP_K) -> str:
+        """The examples for the SQL prompt's ``{examples}``, or "" when none is relevant."""
+        examples = self.search(question, k)
+        if not examples:
+            return ""
+        # Indented like the prompt templates the examples are pasted into
+        return "For example:\n    " + "\n\n    ".join(
+            f"Question: {example['question']}\n    SQL Query: {example['sql']}" for example in examples
+        )
+
+
+# Function to get the example store of a database; seeds names the seed file (the database name
+# by default), learned examples are kept per database
+def get_example_store(db: SQLDatabase, seeds: str = None) -> ExampleStore:
+    key = database_key(db)
+    name = os.path.splitext(os.path.basename(db._engine.url.database or "default"))[0]
+    with _lock:
+        store = _stores.get(key)
+        seed_path = os.path.join(EXAMPLES_DIR, f"{seeds}.jsonl") if seeds else None
+        # Without seeds, whichever store the database already has (e.g. when approving a query)
+        if store is None or (seed_path and store.seed_path != seed_path):
+            store = ExampleStore(
+                seed_path=seed_path or os.path.join(EXAMPLES_DIR, f"{name}.jsonl"),
+                learned_path=os.path.join(CACHE_DIR, "examples", f"{name}.jsonl"),
+            )
+            _stores[key] = store
+        return store
@@ -0,0 +1,126 @@
+"""Token-budgeted conversation memory for the ``{chat_history}`` prompt variable.
+
+The last few messages are kept verbatim, older ones are folded into a rolling summary
+that is updated in the background (never on the critical path of a turn), and the last
+generated SQL query is always kept because that is what follow-up questions build on.
+The rendered text never exceeds ``token_budget`` estimated tokens.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from text_index import estimate_tokens
+
+
+RECENT_MESSAGES = 6
+TOKEN_BUDGET = 1000
+SUMMARY_TOKENS = 300
+
+SUMMARY_TEMPLATE = """Progressively summarize the conversation between a user and a SQL assistant. Keep the
+tables, columns, filters and figures that were discussed, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+
+# Function to format a message as one line of the rendered history
+def _format(message) -> str:
+    role = "Human" if isinstance(message, HumanMessage) else "AI"
+    return f"{role}: {message.content}"
+
+
+# Function to cut text down to roughly max_tokens tokens
+def _truncate(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(0, max_tokens * 4 - 3)] + "..."
+
+
+class ConversationMemory:
+    def __init__(self, recent_messages: int = RECENT_MESSAGES, token_budget: int = TOKEN_BUDGET):
+        self.recent_messages = recent_messages
+        self.token_budget = token_budget
+        self.summary = ""
+        # Number of leading chat_history messages already folded into the summary
+        self.summarized = 0
+        self.last_sql = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def record_sql(self, sql: str):
+        self.last_sql = sql
+
+    @staticmethod
+    def _previous_messages(chat_history: list, question: str) -> list:
+        messages = [m for m in chat_history or [] if isinstance(m, (AIMessage, HumanMessage))]
+        # The Streamlit apps append the current question before asking; it is sent separately
+        if messages and isinstance(messages[-1], HumanMessage) and messages[-1].content == question:
+            messages = messages[:-1]
+        return messages
+
+    def render(self, chat_history: list, question: str = "", last_sql: str = None) -> str:
+        """Return the conversation history text for the prompt, within the token budget.
+
+        Space goes first to the last SQL query, then to the recent messages (newest first),
+        then to the summary, and last to older messages the summary does not cover yet.
+        ``last_sql`` replaces the recorded query ("" for none), e.g. with the one from
+        before the turn being answered.
+        """
+        messages = self._previous_messages(chat_history, question)
+        cut = max(0, len(messages) - self.recent_messages)
+        with self._lock:
+            summary, summarized = self.summary, min(self.summarized, cut)
+        last_sql = self.last_sql if last_sql is None else last_sql
+        sql_part = f"Previous SQL query: {last_sql}" if last_sql else ""
+        # A long query must not push the rest of the history over the budget
+        sql_part = _truncate(sql_part, self.token_budget)
+        budget = self.token_budget - estimate_tokens(sql_part)
+
+        def fit(candidates: list) -> list:
+            nonlocal budget
+            lines = []
+            for message in reversed(candidates):
+                line = _format(message)
+                if estimate_tokens(line) > budget:
+                    break
+                lines.append(line)
+                budget -= estimate_tokens(line)
+            return lines[::-1]
+
+        recent = fit(messages[cut:])
+        summary_part = ""
+        if summary and budget > 0:
+            summary_part = _truncate(f"Summary of the earlier conversation: {summary}", budget)
+            budget -= estimate_tokens(summary_part)
+        # Older messages not summarized yet are kept verbatim until the summary catches up
+        unsummarized = fit(messages[summarized:cut]) if len(recent) == len(messages[cut:]) else []
+        return "\n".join(part for part in [summary_part, sql_part, *unsummarized, *recent] if part)
+
+    def summarize_async(self, chat_history: list, llm, question: str = ""):
+        """Fold messages that left the verbatim window into the summary, in the background."""
+        messages = self._previous_messages(chat_history, question)
+        cut = max(0, len(messages) - self.recent_messages)
+        with self._lock:
+            if cut <= self.summarized or (self._pending is not None and not self._pending.done()):
+                return
+            self._pending = _executor.submit(self._summarize, messages[self.summarized:cut], cut, llm)
+
+    def _summarize(self, messages: list, upto: int, llm):
+        prompt = ChatPromptTemplate.from_template(SUMMARY_TEMPLATE)
+        summary = (prompt | llm).invoke({
+            "summary": self.summary or "(empty)",
+            "new_lines": "\n".join(_format(m) for m in messages),
+            "max_words": SUMMARY_TOKENS * 3 // 4,
+        }).content
+        with self._lock:
+            self.summary = summary.strip()
+            self.summarized = upto
@@ -0,0 +1,102 @@
+"""Model tiering for SQL generation: a fast model first, the strong model when it is needed.
+
+``with_model_tiers`` puts two SQL chains behind one runnable. Questions that look complex
+(comparisons, ratios, rankings, trends, ...) go straight to the ``strong`` tier. Any other
+question is first given to the ``fast`` tier, whose query then has to pass validation:
+``sql_guard.prepare_sql``, a plan from the database (``check_cost`` runs EXPLAIN, which
+also catches unknown tables and columns) and no multi-join, subquery, set operation or
+window function. When it doesn't, the strong tier writes the query instead. A query that
+passes but fails to run is repaired by the pipeline, with the strong model.
+
+Each decision is counted in ``sqlbot_sql_route_total{tier, reason}``. The calls of each tier
+are traced as their own stage (``sql_fast``, ``sql_strong``), so the latency, tokens and
+cost per tier show up in the turn trace and on ``/metrics``.
+"""
+import asyncio
+import os
+import re
+
+from langchain_community.utilities import SQLDatabase
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from sql_guard import GuardError, QueryTooExpensiveError, check_cost, is_repairable, prepare_sql
+from tracing import metrics, span
+
+
+# An empty SQLBOT_FAST_MODEL turns tiering off
+FAST_MODEL = os.getenv("SQLBOT_FAST_MODEL", "gpt-3.5-turbo-0125")
+MAX_FAST_JOINS = 1
+
+_COMPLEX_QUESTION_RE = re.compile(
+    r"\b(compar\w*|versus|vs|ratio|percent\w*|proportion|share|growth|grew|increase[sd]?|decrease[sd]?|"
+    r"changed?|trends?|correlat\w*|rank\w*|cumulative|running|median|difference|year over year)\b",
+    re.I,
+)
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")")
+_JOIN_RE = re.compile(r"\bjoin\b", re.I)
+_COMPLEX_SQL_RE = re.compile(r"\(\s*select\b|\b(union|intersect|except)\b|\bover\s*\(|^\s*with\b", re.I)
+
+
+# Function to tell whether a question should go straight to the strong model
+def is_complex_question(question: str) -> bool:
+    return bool(_COMPLEX_QUESTION_RE.search(question))
+
+
+# Function to tell whether a query is beyond what the fast model is trusted with
+def is_complex_sql(sql: str) -> bool:
+    code = _LITERAL_RE.sub("''", sql)
+    return len(_JOIN_RE.findall(code)) > MAX_FAST_JOINS or bool(_COMPLEX_SQL_RE.search(code))
+
+
+# Function to validate SQL from the fast model; returns why it has to be escalated, or "" when it can run
+def validate_sql(db: SQLDatabase, sql: str) -> str:
+    try:
+        sql = prepare_sql(sql)
+    except GuardError:
+        return "invalid_sql"
+    if is_complex_sql(sql):
+        return "complex_sql"
+    try:
+        check_cost(db, sql)
+    except Exception as error:
+        if not is_repairable(error):
+            raise
+        return "too_expensive" if isinstance(error, QueryTooExpensiveError) else "explain_failed"
+    return ""
+
+
+def record_route(tier: str, reason: str):
+    metrics.inc("sqlbot_sql_route_total", tier=tier, reason=reason)
+
+
+# Function to route SQL generation between a fast and a strong chain taking the same prompt variables
+def with_model_tiers(db: SQLDatabase, fast_chain: Runnable, strong_chain: Runnable) -> Runnable:
+    def generate(vars: dict, config=None) -> str:
+        reason = "complex_question" if is_complex_question(vars["question"]) else ""
+        if not reason:
+            with span("sql_fast"):
+                sql = fast_chain.invoke(vars, config)
+            reason = validate_sql(db, sql)
+            if not reason:
+                record_route("fast", "validated")
+                return sql
+        with span("sql_strong", reason=reason):
+            sql = strong_chain.invoke(vars, config)
+        record_route("strong", reason)
+        return sql
+
+    async def agenerate(vars: dict, config=None) -> str:
+        reason = "complex_question" if is_complex_question(vars["question"]) else ""
+        if not reason:
+            with span("sql_fast"):
+                sql = await fast_chain.ainvoke(vars, config)
+            reason = await asyncio.to_thread(validate_sql, db, sql)
+            if not reason:
+                record_route("fast", "validated")
+                return sql
+        with span("sql_strong", reason=reason):
+            sql = await strong_chain.ainvoke(vars, config)
+        record_route("strong", reason)
+        return sql
+
+    return RunnableLambda(generate, afunc=agenerate)
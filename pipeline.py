@@ -0,0 +1,434 @@
+"""The chat pipeline (SQL generation -> query execution -> answer), built once and reused.
+
+Building the prompts and ``ChatOpenAI`` clients on every question is pure overhead, so a
+``SQLPipeline`` is cached per database, model and prompt templates. All LLM clients share
+one keep-alive HTTP connection pool, so a turn only pays for the model calls themselves.
+
+``ainvoke``/``astream`` are the asyncio-native versions of a turn: LLM calls use the async
+OpenAI client, queries use the async DB driver when one is installed, and independent
+steps (schema lookup, history rendering) run concurrently. Run them on the shared loop
+from ``async_runtime`` (or one long-lived loop), since the async HTTP pool is bound to it.
+
+The SQL prompt's ``{examples}`` are the few-shot examples most similar to the question,
+from the database's ``example_store``; queries that run and return rows are added to it.
+
+Generated SQL goes through ``sql_guard`` before it runs. When the guard or the database
+rejects it, the error is fed back to the LLM for a corrected query, up to ``MAX_REPAIRS``
+times per turn.
+
+A turn can also be given a ``web_ingest.WebIndex``: the answer prompt then gets the
+website chunks most relevant to the question as ``{website_context}``.
+
+Simple results skip the answer LLM call: ``answer_policy`` decides per turn whether the
+answer is written deterministically (``fast``), by the LLM, or ``deferred`` until the
+user asks for an explanation.
+
+SQL is written by a fast model first and by ``MODEL`` only when the question looks complex
+or the fast model's query fails validation (see ``model_router``); repairs always use
+``MODEL``.
+
+Aggregate queries that keep coming back are answered from ``rollups`` (summary tables in a
+local SQLite sidecar) when one covers them, instead of scanning the base tables. Rollups are
+opt-in: ``SQLBOT_ROLLUPS=1``.
+
+Every turn is traced (see ``tracing``): ``stream``/``astream`` end with a ``("trace",
+summary)`` event holding the time, tokens, rows and cache hits of each stage.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+from langchain_openai import ChatOpenAI
+
+from answer_policy import POLICY, choose_path, render_text
+from example_store import get_example_store
+from memory import ConversationMemory
+from model_router import FAST_MODEL, record_route, with_model_tiers
+from result_cache import result_cache
+from result_fetch import afetch_result, fetch_result
+from rollups import ENABLED as ROLLUPS_ENABLED, get_rollups
+from schema_index import get_relevant_schema
+from sql_cache import cache_key, prompt_scope, sql_cache, with_sql_cache
+from sql_guard import check_cost, describe_error, is_repairable, prepare_sql
+from text_index import estimate_tokens
+from tracing import Trace, TraceCallbackHandler, metrics, span
+
+
+MODEL = os.getenv("SQLBOT_MODEL", "gpt-4-0125-preview")
+SUMMARY_MODEL = os.getenv("SQLBOT_SUMMARY_MODEL", "gpt-3.5-turbo")
+MAX_PIPELINES = 32
+HTTP_TIMEOUT = float(os.getenv("SQLBOT_HTTP_TIMEOUT", "120"))
+MAX_REPAIRS = int(os.getenv("SQLBOT_MAX_REPAIRS", "2"))
+
+REPAIR_TEMPLATE = """
+    The SQL query below was written to answer a question about a database, but it could not be run.
+    Based on the table schema below, rewrite it so that it runs and still answers the question.
+
+    <SCHEMA>{schema}</SCHEMA>
+
+    Question: {question}
+    SQL Query: {query}
+    Error: {error}
+
+    Write only the corrected SQL query and nothing else. Do not wrap the SQL query in any other text, not even backticks.
+
+    Corrected SQL Query:
+"""
+
+_http_client = None
+_async_http_client = None
+_llms = {}
+_pipelines = OrderedDict()
+_lock = threading.Lock()
+
+
+# Function to get the HTTP client shared by every LLM client, keeping connections alive
+def get_http_client() -> httpx.Client:
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                timeout=HTTP_TIMEOUT,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+            )
+        return _http_client
+
+
+# Function to get the async HTTP client shared by every LLM client
+def get_async_http_client() -> httpx.AsyncClient:
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+            )
+        return _async_http_client
+
+
+# Function to get a shared chat model client for a model name
+def get_llm(model: str = MODEL, **kwargs) -> ChatOpenAI:
+    key = (model, tuple(sorted(kwargs.items())))
+    llm = _llms.get(key)
+    if llm is None:
+        llm = ChatOpenAI(model=model, http_client=get_http_client(),
+                         http_async_client=get_async_http_client(), **kwargs)
+        _llms[key] = llm
+    return llm
+
+
+class SQLPipeline:
+    """One chat pipeline; ``llm`` replaces the OpenAI models (e.g. a fake model in benchmarks).
+
+    ``fast_llm`` is the fast SQL tier; by default it is ``FAST_MODEL``, unless ``llm`` is given.
+    With ``use_cache=False`` every turn writes its SQL and runs it, bypassing the SQL and
+    result caches. ``seeds`` names the app's seed examples (see ``example_store``).
+    """
+
+    def __init__(self, db: SQLDatabase, sql_template: str, answer_template: str, model: str = MODEL,
+                 llm: BaseChatModel = None, fast_llm: BaseChatModel = None, use_cache: bool = True,
+                 seeds: str = None):
+        self.db = db
+        self.model = model
+        self.use_cache = use_cache
+        self.summary_llm = llm if llm is not None else get_llm(SUMMARY_MODEL)
+        if fast_llm is None and llm is None and FAST_MODEL and FAST_MODEL != model:
+            fast_llm = get_llm(FAST_MODEL)
+        llm = llm if llm is not None else get_llm(model)
+        self.examples = get_example_store(db, seeds)
+        self.answer_policy = POLICY
+        self.rollups = get_rollups(db) if ROLLUPS_ENABLED else None
+        sql_prompt = ChatPromptTemplate.from_template(sql_template)
+        generate_sql = sql_prompt | llm | StrOutputParser()
+        if fast_llm is not None:
+            generate_sql = with_model_tiers(
+                db,
+                (sql_prompt | fast_llm | StrOutputParser()).with_config(tags=["sqlbot:sql_fast"]),
+                generate_sql.with_config(tags=["sqlbot:sql_strong"]),
+            )
+        else:
+            generate_sql = generate_sql.with_config(tags=["sqlbot:sql"])
+        self.sql_scope = prompt_scope(sql_template, llm, fast_llm)
+        self.sql_chain = (
+            RunnablePassthrough.assign(schema=self.get_schema, chat_history=self.get_history,
+                                       examples=self.get_examples)
+            | generate_sql
+        )
+        if use_cache:
+            self.sql_chain = with_sql_cache(db, self.sql_chain, scope=self.sql_scope)
+        self.answer_chain = (
+            RunnablePassthrough.assign(schema=self.get_schema, chat_history=self.get_history,
+                                       website_context=self.get_website_context)
+            | ChatPromptTemplate.from_template(answer_template)
+            | llm
+            | StrOutputParser()
+        ).with_config(tags=["sqlbot:answer"])
+        # No chat history here: the question, the failed query and the error are enough
+        self.repair_chain = (
+            RunnablePassthrough.assign(schema=self.get_schema)
+            | ChatPromptTemplate.from_template(REPAIR_TEMPLATE)
+            | llm
+            | StrOutputParser()
+        ).with_config(tags=["sqlbot:repair"])
+
+    def get_schema(self, vars: dict) -> str:
+        with span("schema") as attributes:
+            schema = get_relevant_schema(self.db, vars["question"], vars["chat_history"])
+            attributes["schema_tokens"] = estimate_tokens(schema)
+        return schema
+
+    def get_examples(self, vars: dict) -> str:
+        return self.examples.format(vars["question"])
+
+    def get_history(self, vars: dict) -> str:
+        """Render ``{chat_history}`` for a prompt; the message list itself stays in ``vars``."""
+        memory = vars.get("memory")
+        if memory is None:
+            return ConversationMemory().render(vars["chat_history"], vars["question"])
+        memory.summarize_async(vars["chat_history"], self.summary_llm, vars["question"])
+        return memory.render(vars["chat_history"], vars["question"], vars.get("previous_sql"))
+
+    def get_website_context(self, vars: dict) -> str:
+        """Render ``{website_context}``: the chunks of the ingested website that best match the question."""
+        website = vars.get("website")
+        if website is None:
+            return ""
+        with span("website") as attributes:
+            context = website.context(vars["question"])
+            attributes["website_tokens"] = estimate_tokens(context)
+        return context
+
+    def choose_answer_path(self, question: str, response) -> tuple:
+        path, kind = choose_path(question, response, self.answer_policy)
+        metrics.inc("sqlbot_answer_path_total", path=path, kind=kind)
+        return path, kind
+
+    def execute_query(self, sql: str):
+        """Run checked SQL: from a rollup when one covers it, on the database otherwise."""
+        result = self.rollups.run(sql) if self.rollups is not None else None
+        if result is None:
+            # The EXPLAIN cost check only runs when the query goes to the database
+            result = fetch_result(self.db, check_cost(self.db, sql))
+        return result
+
+    def remember_sql(self, inputs: dict, query: str):
+        """Cache a repaired query for the question, in place of the one the database rejected."""
+        if not self.use_cache:
+            return
+        fingerprint, context = cache_key(self.db, inputs, self.sql_scope)
+        sql_cache.put(fingerprint, inputs["question"], query, context)
+
+    def run_query(self, query: str):
+        try:
+            sql = prepare_sql(query)
+            if self.use_cache:
+                result = result_cache.run(self.db, sql, execute=self.execute_query)
+            else:
+                result = self.execute_query(sql)
+        except Exception:
+            # Don't keep serving SQL that the database rejects
+            sql_cache.forget(query)
+            raise
+        if self.rollups is not None:
+            self.rollups.record(sql)
+        return result
+
+    async def arun_query(self, query: str):
+        async def execute(sql: str):
+            result = await asyncio.to_thread(self.rollups.run, sql) if self.rollups is not None else None
+            if result is None:
+                await asyncio.to_thread(check_cost, self.db, sql)
+                result = await afetch_result(self.db, sql)
+            return result
+
+        try:
+            sql = prepare_sql(query)
+            if self.use_cache:
+                result = await result_cache.arun(self.db, sql, execute=execute)
+            else:
+                result = await execute(sql)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.to_thread(sql_cache.forget, query)
+            raise
+        if self.rollups is not None:
+            await asyncio.to_thread(self.rollups.record, sql)
+        return result
+
+    def invoke(self, question: str, chat_history: list, memory: ConversationMemory = None,
+               website=None) -> str:
+        events = self.stream(question, chat_history, memory, website)
+        return "".join(payload for kind, payload in events if kind == "token")
+
+    def stream(self, question: str, chat_history: list, memory: ConversationMemory = None,
+               website=None, callbacks: list = None):
+        """Run the turn stage by stage, yielding ``(kind, payload)`` events.
+
+        ``("sql", query)`` comes once the SQL chain returns, ``("result", result)`` after
+        the database call, then one ``("token", text)`` per chunk of the answer and finally
+        ``("trace", summary)`` with the per-stage timings. A rejected query is followed by a
+        ``("repair", (error, corrected_query))`` event per correction attempt. Right after the
+        result, ``("path", {"path", "kind"})`` tells how the answer is written; for a
+        ``deferred`` answer it also holds ``explain``, which streams the LLM answer on demand.
+        ``callbacks`` are added to the LangChain callbacks of every LLM call of the turn.
+        """
+        inputs = {"question": question, "chat_history": chat_history, "memory": memory, "website": website}
+        trace = Trace(question)
+        config = {"callbacks": [TraceCallbackHandler(trace), *(callbacks or [])]}
+        try:
+            with trace.span("sql"):
+                query = self.sql_chain.invoke(inputs, config)
+            yield "sql", query
+            for attempt in range(MAX_REPAIRS + 1):
+                try:
+                    with trace.span("query") as attributes:
+                        response = self.run_query(query)
+                        attributes.update(_result_attributes(response))
+                    break
+                except Exception as error:
+                    if attempt == MAX_REPAIRS or not is_repairable(error):
+                        raise
+                    with trace.span("repair"):
+                        repair_inputs = {**inputs, "query": query, "error": describe_error(error)}
+                        query = self.repair_chain.invoke(repair_inputs, config).strip()
+                    record_route("strong", "execution_failed")
+                    yield "repair", (repair_inputs["error"], query)
+            if attempt:
+                # So the next time the question is asked it doesn't pay for the failed query again
+                self.remember_sql(inputs, query)
+            self.examples.record(question, query, response, chat_history)
+            yield "result", response
+            answer_inputs = {**inputs, "chat_history": list(chat_history), "query": query, "response": response,
+                             "previous_sql": _remember_query(memory, query)}
+            path, kind = self.choose_answer_path(question, response)
+            info = {"path": path, "kind": kind}
+            if path == "deferred":
+                info["explain"] = lambda: self.answer_chain.stream(answer_inputs)
+            yield "path", info
+            with trace.span("answer", path=path, kind=kind) as attributes:
+                started = time.perf_counter()
+                if path == "llm":
+                    tokens = self.answer_chain.stream(answer_inputs, config)
+                else:
+                    tokens = [render_text(kind, response)]
+                for token in tokens:
+                    attributes.setdefault("first_token_seconds", time.perf_counter() - started)
+                    attributes["chars"] = attributes.get("chars", 0) + len(token)
+                    yield "token", token
+        except GeneratorExit:
+            trace.finish("cancelled")
+            raise
+        except Exception:
+            trace.finish("error")
+            raise
+        yield "trace", trace.finish()
+
+    async def ainvoke(self, question: str, chat_history: list, memory: ConversationMemory = None,
+                      website=None) -> str:
+        events = self.astream(question, chat_history, memory, website)
+        return "".join([payload async for kind, payload in events if kind == "token"])
+
+    async def astream(self, question: str, chat_history: list, memory: ConversationMemory = None,
+                      website=None, callbacks: list = None):
+        """Async version of ``stream``; cancelling it stops the LLM or DB call in flight."""
+        inputs = {"question": question, "chat_history": chat_history, "memory": memory, "website": website}
+        trace = Trace(question)
+        config = {"callbacks": [TraceCallbackHandler(trace), *(callbacks or [])]}
+        try:
+            with trace.span("sql"):
+                query = await self.sql_chain.ainvoke(inputs, config)
+            yield "sql", query
+            for attempt in range(MAX_REPAIRS + 1):
+                try:
+                    with trace.span("query") as attributes:
+                        response = await self.arun_query(query)
+                        attributes.update(_result_attributes(response))
+                    break
+                except Exception as error:
+                    if attempt == MAX_REPAIRS or not is_repairable(error):
+                        raise
+                    with trace.span("repair"):
+                        repair_inputs = {**inputs, "query": query, "error": describe_error(error)}
+                        query = (await self.repair_chain.ainvoke(repair_inputs, config)).strip()
+                    record_route("strong", "execution_failed")
+                    yield "repair", (repair_inputs["error"], query)
+            if attempt:
+                await asyncio.to_thread(self.remember_sql, inputs, query)
+            await asyncio.to_thread(self.examples.record, question, query, response, chat_history)
+            yield "result", response
+            answer_inputs = {**inputs, "chat_history": list(chat_history), "query": query, "response": response,
+                             "previous_sql": _remember_query(memory, query)}
+            path, kind = self.choose_answer_path(question, response)
+            info = {"path": path, "kind": kind}
+            if path == "deferred":
+                info["explain"] = lambda: self.answer_chain.astream(answer_inputs)
+            yield "path", info
+            with trace.span("answer", path=path, kind=kind) as attributes:
+                started = time.perf_counter()
+                if path == "llm":
+                    tokens = self.answer_chain.astream(answer_inputs, config)
+                else:
+                    tokens = _aiter([render_text(kind, response)])
+                async for token in tokens:
+                    attributes.setdefault("first_token_seconds", time.perf_counter() - started)
+                    attributes["chars"] = attributes.get("chars", 0) + len(token)
+                    yield "token", token
+        except (GeneratorExit, asyncio.CancelledError):
+            trace.finish("cancelled")
+            raise
+        except Exception:
+            trace.finish("error")
+            raise
+        yield "trace", trace.finish()
+
+
+# Function to record a turn's query in the conversation memory; returns the query of the turn
+# before, which is what the answer prompt shows as the previous one
+def _remember_query(memory: ConversationMemory, query: str) -> str:
+    if memory is None:
+        return None
+    previous = memory.last_sql or ""
+    memory.record_sql(query)
+    return previous
+
+
+async def _aiter(items: list):
+    for item in items:
+        yield item
+
+
+# Function to describe a query result for the trace: rows returned, result bytes and truncation
+def _result_attributes(result) -> dict:
+    return {
+        "rows": getattr(result, "row_count", 0),
+        "bytes": getattr(result, "nbytes", len(str(result).encode())),
+        "truncated": getattr(result, "truncated", False),
+    }
+
+
+# Function to get the pipeline for a database, model and prompts, building it only once
+def get_pipeline(db: SQLDatabase, sql_template: str, answer_template: str, model: str = MODEL,
+                 llm: BaseChatModel = None, fast_llm: BaseChatModel = None,
+                 use_cache: bool = True, seeds: str = None) -> SQLPipeline:
+    key = (id(db), model, sql_template, answer_template, id(llm) if llm is not None else None,
+           id(fast_llm) if fast_llm is not None else None, use_cache, seeds)
+    with _lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is not None and pipeline.db is db:
+            _pipelines.move_to_end(key)
+            return pipeline
+    pipeline = SQLPipeline(db, sql_template, answer_template, model, llm, fast_llm, use_cache, seeds)
+    with _lock:
+        _pipelines[key] = pipeline
+        while len(_pipelines) > MAX_PIPELINES:
+            _pipelines.popitem(last=False)
+    return pipeline
@@ -0,0 +1,186 @@
+"""In-memory cache of query results, shared by every session of the process.
+
+Results are keyed by the connection URI and the canonicalized SQL text. Each entry
+remembers the data version (``information_schema.TABLES.UPDATE_TIME``) of every table the
+query reads, and is dropped as soon as one of them changes. As the database may report
+those versions late, every entry also expires after ``max_age`` seconds, and
+``invalidate()`` busts entries by hand. Memory use is capped at ``max_bytes`` with LRU eviction.
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_community.utilities import SQLDatabase
+
+from schema_cache import catalog, database_key
+from tracing import record_cache
+
+
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_COMMENT_RE = re.compile(r"--[^\n]*|#[^\n]*|/\*.*?\*/", re.S)
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+((?:[`\"]?\w+[`\"]?\.)?[`\"]?\w+[`\"]?)", re.I)
+_READ_ONLY_RE = re.compile(r"^\s*\(?\s*(select|with|show|describe|desc|explain)\b", re.I)
+_VOLATILE_RE = re.compile(
+    r"\b(now|rand|random|uuid|sysdate|curdate|curtime|current_date|current_time|current_timestamp|"
+    r"unix_timestamp|utc_timestamp|last_insert_id|connection_id)\b",
+    re.I,
+)
+
+
+# Function to canonicalize SQL: no comments, single spaces, lowercase outside literals, no trailing ";"
+def canonicalize_sql(sql: str) -> str:
+    parts = []
+    for i, part in enumerate(_LITERAL_RE.split(sql)):
+        if i % 2:
+            parts.append(part)
+        else:
+            part = _COMMENT_RE.sub(" ", part)
+            parts.append(re.sub(r"\s*([(),=<>+*/-])\s*", r"\1", re.sub(r"\s+", " ", part)).lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+# Function to list the tables a query reads from (best effort, from its FROM and JOIN clauses)
+def referenced_tables(sql: str) -> set:
+    code = "".join(part for i, part in enumerate(_LITERAL_RE.split(sql)) if i % 2 == 0 or part.startswith("`"))
+    return {match.split(".")[-1].strip('`"') for match in _TABLE_RE.findall(_COMMENT_RE.sub(" ", code))}
+
+
+# Function to decide whether a query's result can be cached at all
+def is_cacheable(sql: str) -> bool:
+    return bool(_READ_ONLY_RE.match(sql)) and not _VOLATILE_RE.search(_LITERAL_RE.sub("''", sql))
+
+
+# Function to estimate how many bytes a cached result holds
+def _sizeof(value) -> int:
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, bytes):
+        return len(value)
+    return len(str(value).encode("utf-8"))
+
+
+class _CachedResult:
+    def __init__(self, value, versions: dict, elapsed: float):
+        self.value = value
+        self.versions = versions
+        self.elapsed = elapsed
+        self.size = _sizeof(value)
+        self.created_at = time.monotonic()
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_age: float = 600.0):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.db_time_saved = 0.0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _table_versions(self, db: SQLDatabase, tables: set) -> dict:
+        versions = catalog.versions(db)
+        return {table: versions[table][0] if table in versions else None for table in tables}
+
+    def _is_fresh(self, entry: _CachedResult, versions: dict) -> bool:
+        if entry.versions != versions:
+            return False
+        # Also bounds the tables without a data version (e.g. SQLite, or an unknown table)
+        return time.monotonic() - entry.created_at < self.max_age
+
+    def _lookup(self, key, versions: dict):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry, versions):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += entry.size
+                self.db_time_saved += entry.elapsed
+                record_cache("result", True)
+                return entry
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            record_cache("result", False)
+            return None
+
+    def _store(self, key, value, versions: dict, elapsed: float):
+        entry = _CachedResult(value, versions, elapsed)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def run(self, db: SQLDatabase, sql: str, execute=None):
+        """Return the result of ``sql``, from the cache when it is still valid.
+
+        ``execute`` runs the query on a miss and defaults to ``db.run``.
+        """
+        execute = execute or db.run
+        if not is_cacheable(sql):
+            return execute(sql)
+        key = (database_key(db), canonicalize_sql(sql))
+        versions = self._table_versions(db, referenced_tables(sql))
+        entry = self._lookup(key, versions)
+        if entry is not None:
+            return entry.value
+        started = time.perf_counter()
+        value = execute(sql)
+        self._store(key, value, versions, time.perf_counter() - started)
+        return value
+
+    async def arun(self, db: SQLDatabase, sql: str, execute):
+        """Async version of ``run``; ``execute`` is a coroutine function taking the SQL."""
+        if not is_cacheable(sql):
+            return await execute(sql)
+        key = (database_key(db), canonicalize_sql(sql))
+        # The version check is a (rate limited) sync query, so keep it off the event loop
+        versions = await asyncio.to_thread(self._table_versions, db, referenced_tables(sql))
+        entry = self._lookup(key, versions)
+        if entry is not None:
+            return entry.value
+        started = time.perf_counter()
+        value = await execute(sql)
+        self._store(key, value, versions, time.perf_counter() - started)
+        return value
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key).size
+
+    def invalidate(self, db: SQLDatabase = None, table: str = None):
+        """Drop cached results for a database and/or a table (everything by default)."""
+        with self._lock:
+            for key in list(self._entries):
+                if db is not None and key[0] != database_key(db):
+                    continue
+                if table is not None and table not in self._entries[key].versions:
+                    continue
+                self._remove(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "bytes_saved": self.bytes_saved,
+            "db_time_saved": round(self.db_time_saved, 3),
+        }
+
+
+# Shared cache used by all the Streamlit entry points
+result_cache = ResultCache()
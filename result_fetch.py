@@ -0,0 +1,128 @@
+"""Bounded query execution that keeps large results out of memory and out of the prompt.
+
+``fetch_result`` reads rows in batches through a streaming (server-side, where the driver
+supports it) cursor and stops at a row cap or a byte cap. Rows are buffered column by
+column. The LLM only sees ``QueryResult.summary()`` - the row count, per-column
+statistics and the first rows - while the UI can page through the whole fetched result.
+
+Drivers without server-side cursors (e.g. ``mysql+mysqlconnector``) buffer the whole result
+before the first row is fetched, so there only the LIMIT that ``sql_guard.prepare_sql`` adds
+bounds the memory used, and a query with its own larger LIMIT is read in full. The apps
+therefore connect to MySQL through PyMySQL (``mysql+pymysql``), whose streaming cursor
+fetches batch by batch; ``aiomysql``, the async driver, is built on it.
+"""
+import asyncio
+from collections import Counter
+from decimal import Decimal
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import text
+
+from connection_manager import get_async_engine
+
+
+MAX_ROWS = 10_000
+MAX_BYTES = 8 * 1024 * 1024
+BATCH_SIZE = 500
+HEAD_ROWS = 20
+
+
+class QueryResult:
+    def __init__(self, columns: list):
+        self.columns = list(columns)
+        self.data = {column: [] for column in self.columns}
+        self.row_count = 0
+        self.nbytes = 0
+        self.truncated = False
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            self.data[column].append(value)
+        self.row_count += 1
+        self.nbytes += sum(len(str(value)) for value in row) + 8 * len(row)
+
+    def extend(self, batch, max_rows: int, max_bytes: int) -> bool:
+        """Append a batch of rows; return False once a cap is hit and fetching should stop."""
+        for row in batch:
+            if self.row_count >= max_rows or self.nbytes >= max_bytes:
+                self.truncated = True
+                return False
+            self.append(row)
+        return True
+
+    def rows(self, start: int = 0, stop: int = None) -> list:
+        stop = self.row_count if stop is None else min(stop, self.row_count)
+        return [tuple(self.data[column][i] for column in self.columns) for i in range(start, stop)]
+
+    def to_dataframe(self, start: int = 0, stop: int = None):
+        import pandas as pd
+
+        return pd.DataFrame({column: values[start:stop] for column, values in self.data.items()})
+
+    def describe_rows(self) -> str:
+        if self.truncated:
+            return f"{self.row_count:,} rows, truncated"
+        return f"{self.row_count:,} rows"
+
+    def column_stats(self, column: str) -> str:
+        values = self.data[column]
+        present = [v for v in values if v is not None]
+        nulls = len(values) - len(present)
+        if present and all(isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) for v in present):
+            mean = sum(float(v) for v in present) / len(present)
+            return f"min {min(present)}, max {max(present)}, mean {mean:.4g}, {nulls} nulls"
+        counts = Counter(str(v) for v in present)
+        common = ", ".join(f"{value!r} ({count})" for value, count in counts.most_common(3))
+        return f"{len(counts)} distinct values, most common: {common or 'none'}, {nulls} nulls"
+
+    def summary(self, head_rows: int = HEAD_ROWS) -> str:
+        """Compact text for the answer prompt."""
+        if self.row_count <= head_rows:
+            return str(self.rows())
+        if self.truncated:
+            lines = [f"The query returned more than {self.row_count:,} rows; only the first {self.row_count:,} were fetched."]
+        else:
+            lines = [f"The query returned {self.row_count:,} rows."]
+        lines.append("Column statistics:")
+        lines.extend(f"- {column}: {self.column_stats(column)}" for column in self.columns)
+        lines.append(f"First {head_rows} rows ({', '.join(self.columns)}):")
+        lines.append(str(self.rows(0, head_rows)))
+        return "\n".join(lines)
+
+    # The prompt templates format {response} with str(), so they get the summary
+    def __str__(self):
+        return self.summary()
+
+
+# Function to run a query and fetch at most max_rows rows / max_bytes bytes of its result
+def fetch_result(db: SQLDatabase, sql: str, max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES,
+                 batch_size: int = BATCH_SIZE) -> QueryResult:
+    with db._engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=batch_size)
+        cursor = conn.execute(text(sql))
+        if not cursor.returns_rows:
+            return QueryResult([])
+        result = QueryResult(cursor.keys())
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch or not result.extend(batch, max_rows, max_bytes):
+                break
+        # Closing an unfinished server-side cursor discards the rest of the result
+        cursor.close()
+    return result
+
+
+# Function to fetch a bounded result with the async driver, or in a worker thread without one
+async def afetch_result(db: SQLDatabase, sql: str, max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES,
+                        batch_size: int = BATCH_SIZE) -> QueryResult:
+    engine = get_async_engine(db)
+    if engine is None:
+        return await asyncio.to_thread(fetch_result, db, sql, max_rows, max_bytes, batch_size)
+    async with engine.connect() as conn:
+        stream = await conn.stream(text(sql))
+        result = QueryResult(stream.keys())
+        async for batch in stream.partitions(batch_size):
+            if not result.extend(batch, max_rows, max_bytes):
+                break
+        await stream.close()
+    return result
@@ -0,0 +1,711 @@
+"""Rollup (summary) tables for frequently asked aggregate queries, with transparent rewrite.
+
+Every query the pipeline runs is logged by shape: the tables it reads (its FROM clause),
+the columns it groups and filters by, and its aggregates. Once a FROM clause has been
+queried ``HOT_QUERIES`` times, a rollup of it is built over the columns its most frequent
+shapes use (at most ``MAX_DIMENSIONS``): ``SELECT <columns>, COUNT(*), SUM(x), ... GROUP BY
+<columns>``, run once on the database. The app's connections are read-only, so rollups
+live in a SQLite sidecar, ``<SQLBOT_CACHE_DIR>/rollups/<database>.sqlite3``. Rollups are
+opt-in (``SQLBOT_ROLLUPS=1``).
+
+``Rollups.run`` answers a query from a rollup that covers it: the query is rewritten to
+re-aggregate the rollup (counts and sums are summed, AVG is SUM / COUNT) and runs in the
+sidecar instead of scanning the base tables. A rollup is only used while its tables have
+the data versions it was built from (see ``schema_cache``), or for ``MAX_AGE`` seconds
+where changes can't be tracked. Every ``REFRESH_INTERVAL`` seconds a scheduler thread
+builds rollups for new hot shapes, and rebuilds stale ones that were asked for since they
+went stale, swapping them in atomically. A build has to pass the ``sql_guard`` cost check,
+reads at most ``MAX_ROLLUP_ROWS`` rows and is stopped after ``BUILD_TIMEOUT`` seconds.
+After every build, the logged queries the rollup is meant to answer are run both ways, and
+it is dropped if any answer differs.
+
+Only simple shapes are rewritten: GROUP BY plain columns; COUNT, SUM, MIN, MAX, AVG and
+COUNT(DISTINCT <grouped column>); AND-ed filters comparing a column with literals; ORDER BY
+output columns; LIMIT. Filters are only rewritten where SQLite compares like the database:
+the rollup's columns are typed (integer, real, text, date) from the values they hold,
+numbers and dates are compared with literals of their type, and strings with plain
+literals under ``COLLATE NOCASE`` when the column's collation is case-insensitive (ASCII
+values only) or as they are when it is binary. Anything else runs on the database as before.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import text
+
+from connection_manager import connect_with_timeout
+from result_cache import referenced_tables
+from result_fetch import BATCH_SIZE, MAX_BYTES, MAX_ROWS, QueryResult
+from schema_cache import catalog, database_key
+from sql_cache import CACHE_DIR
+from sql_guard import QueryTooExpensiveError, check_cost
+from tracing import metrics, record_cache, span
+
+
+ENABLED = os.getenv("SQLBOT_ROLLUPS", "0") == "1"
+HOT_QUERIES = int(os.getenv("SQLBOT_ROLLUP_HOT_QUERIES", "3"))
+REFRESH_INTERVAL = float(os.getenv("SQLBOT_ROLLUP_REFRESH_INTERVAL", "60"))
+MAX_DIMENSIONS = 5
+MAX_ROLLUP_ROWS = 200_000
+# A rollup is only kept if it has at least this many times fewer rows than it summarizes
+MIN_REDUCTION = 10
+MAX_AGE = 600.0
+# Seconds a rollup build (or its verification) may run; longer than the chat's statement timeout
+BUILD_TIMEOUT = float(os.getenv("SQLBOT_ROLLUP_BUILD_TIMEOUT", "300"))
+# Logged shapes not seen for this long are no longer hot
+LOG_WINDOW = 7 * 24 * 3600
+# How long a rollup that was dropped (too expensive, too large, not smaller, wrong answers, failed) is not retried
+RETRY_AFTER = 24 * 3600
+VERIFY_QUERIES = 3
+
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")")
+_COMMENT_RE = re.compile(r"--[^\n]*|#[^\n]*|/\*.*?\*/", re.S)
+_COLUMN = r"`?\w+`?(?:\.`?\w+`?)?"
+_ALIAS = r"(?:\s+(?:as\s+)?(?P<alias>`?\w+`?))?"
+_DIMENSION_RE = re.compile(rf"^\s*(?P<column>{_COLUMN}){_ALIAS}\s*$", re.I)
+_AGGREGATE_RE = re.compile(
+    rf"^\s*(?P<expression>(?P<function>count|sum|min|max|avg)\s*\(\s*(?P<distinct>distinct\s+)?"
+    rf"(?P<argument>\*|{_COLUMN})\s*\)){_ALIAS}\s*$",
+    re.I,
+)
+_QUERY_RE = re.compile(
+    r"^select\s+(?P<select>.+?)\s+from\s+(?P<source>.+?)(?:\s+where\s+(?P<where>.+?))?"
+    r"(?:\s+group\s+by\s+(?P<group>.+?))?(?:\s+order\s+by\s+(?P<order>.+?))?(?:\s+limit\s+(?P<limit>\d+))?$",
+    re.I | re.S,
+)
+_PREDICATE_RE = re.compile(
+    rf"^\s*(?P<column>{_COLUMN})\s*(?P<operator>=|<>|!=|<=|>=|<|>|not\s+in|in|not\s+like|like|not\s+between|"
+    rf"between|is\s+not|is)\s*(?P<value>.+?)\s*$",
+    re.I,
+)
+# A filter value, with its literals masked: strings, numbers, NULL, lists and BETWEEN ... AND ...
+_VALUE_RE = re.compile(r"^(?:'~*'|\"~*\"|-?\d+(?:\.\d+)?|null|true|false|and|[(),\s])+$", re.I)
+_ORDER_RE = re.compile(r"^\s*(?P<expression>.+?)(?:\s+(?P<direction>asc|desc))?\s*$", re.I)
+_KEYWORD_RE = re.compile(r"\b(select|union|where|group|having|order|limit|offset|window|into)\b", re.I)
+_MODIFIER_RE = re.compile(r"^(distinct|all|distinctrow|high_priority|straight_join|sql_\w+)\b", re.I)
+_FILTER_LITERAL_RE = re.compile(r"'(?:[^'\\]|'')*'|\"(?:[^\"\\]|\\.)*\"|-?\d+(?:\.\d+)?|\bnull\b|\btrue\b|\bfalse\b", re.I)
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# SQLite column type of each kind of dimension; dates are kept as their ISO text
+_COLUMN_TYPES = {"integer": "INTEGER", "real": "REAL", "text": "TEXT", "date": "TEXT"}
+_EQUALITY_OPERATORS = {"=", "<>", "!=", "IN", "NOT IN"}
+
+logger = logging.getLogger(__name__)
+_instances = {}
+_lock = threading.Lock()
+_scheduler = None
+
+
+# Function to drop comments and collapse whitespace outside string literals
+def _normalize(sql: str) -> str:
+    parts = _LITERAL_RE.split(sql)
+    sql = "".join(part if i % 2 else re.sub(r"\s+", " ", _COMMENT_RE.sub(" ", part)) for i, part in enumerate(parts))
+    return sql.strip().rstrip(";").strip()
+
+
+# Function to blank out the inside of string literals, keeping every character at its position
+def _mask(sql: str) -> str:
+    return _LITERAL_RE.sub(lambda m: m.group()[0] + "~" * (len(m.group()) - 2) + m.group()[-1], sql)
+
+
+# Function to split masked[start:end] on a top-level separator ("," or "and"); returns (start, end) spans
+def _split(masked: str, start: int, end: int, separator: str) -> list:
+    words = r"|\bbetween\b|\band\b" if separator == "and" else "|,"
+    spans, depth, begin, between = [], 0, start, False
+    for token in re.compile(r"\(|\)" + words, re.I).finditer(masked, start, end):
+        word = token.group().lower()
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            depth -= 1
+        elif word == "between":
+            between = True
+        elif depth == 0 and between:
+            # The AND of BETWEEN x AND y
+            between = False
+        elif depth == 0:
+            spans.append((begin, token.start()))
+            begin = token.end()
+    spans.append((begin, end))
+    return spans
+
+
+def _key(expression: str) -> str:
+    return re.sub(r"\s+", "", expression).replace("`", "").lower()
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# Function to break an aggregate query into its parts, or None when rollups can't answer its shape
+def parse_aggregate(sql: str) -> dict:
+    sql = _normalize(sql)
+    masked = _mask(sql)
+    match = _QUERY_RE.match(masked)
+    if match is None or _MODIFIER_RE.match(match.group("select")) or _KEYWORD_RE.search(match.group("source")):
+        return None
+    items = []
+    for start, end in _split(masked, *match.span("select"), ","):
+        item = sql[start:end]
+        aggregate, dimension = _AGGREGATE_RE.match(item), _DIMENSION_RE.match(item)
+        if aggregate is not None:
+            function, argument = aggregate.group("function").lower(), aggregate.group("argument")
+            distinct = bool(aggregate.group("distinct"))
+            if distinct and (function != "count" or argument == "*"):
+                return None
+            items.append({
+                "kind": "aggregate", "function": function, "distinct": distinct,
+                "argument": _key(argument), "argument_expression": argument,
+                "key": _key(aggregate.group("expression")),
+                "name": (aggregate.group("alias") or aggregate.group("expression")).strip("`"),
+            })
+        elif dimension is not None:
+            column = dimension.group("column")
+            items.append({
+                "kind": "dimension", "column": _key(column), "expression": column, "key": _key(column),
+                "name": (dimension.group("alias") or column.split(".")[-1]).strip("`"),
+            })
+        else:
+            return None
+
+    dimensions, group = {}, []
+    if match.group("group"):
+        for start, end in _split(masked, *match.span("group"), ","):
+            column = sql[start:end].strip()
+            if column.isdigit() and 0 < int(column) <= len(items) and items[int(column) - 1]["kind"] == "dimension":
+                column = items[int(column) - 1]["expression"]
+            if not re.fullmatch(_COLUMN, column):
+                return None
+            group.append(_key(column))
+            dimensions[_key(column)] = column
+    if any(item["kind"] == "dimension" and item["column"] not in group for item in items):
+        return None
+
+    where = []
+    if match.group("where"):
+        for start, end in _split(masked, *match.span("where"), "and"):
+            predicate = _PREDICATE_RE.match(masked[start:end])
+            if predicate is None or not _VALUE_RE.match(predicate.group("value")):
+                return None
+            column = predicate.group("column")
+            value = sql[start + predicate.start("value"):start + predicate.end("value")]
+            where.append((_key(column), re.sub(r"\s+", " ", predicate.group("operator").upper()), value))
+            dimensions[_key(column)] = column
+
+    measures = {"count:*": ["count", "*"]}
+    for item in items:
+        if item["kind"] == "dimension":
+            continue
+        if item["distinct"]:
+            dimensions[item["argument"]] = item["argument_expression"]
+        elif item["function"] == "avg":
+            measures[f"sum:{item['argument']}"] = ["sum", item["argument_expression"]]
+            measures[f"count:{item['argument']}"] = ["count", item["argument_expression"]]
+        else:
+            measures[f"{item['function']}:{item['argument']}"] = [item["function"], item["argument_expression"]]
+
+    order = []
+    if match.group("order"):
+        for start, end in _split(masked, *match.span("order"), ","):
+            term = _ORDER_RE.match(sql[start:end])
+            expression = _key(term.group("expression"))
+            if expression.isdigit() and 0 < int(expression) <= len(items):
+                index = int(expression) - 1
+            else:
+                matches = [i for i, item in enumerate(items) if expression in (item["key"], item["name"].lower())]
+                if not matches:
+                    return None
+                index = matches[0]
+            order.append((index, (term.group("direction") or "ASC").upper()))
+
+    source = sql[match.start("source"):match.end("source")]
+    return {
+        "source": source,
+        "source_key": source.replace("`", "").lower(),
+        "tables": sorted(referenced_tables(f"FROM {source}")),
+        "items": items,
+        "group": group,
+        "where": where,
+        "order": order,
+        "limit": int(match.group("limit")) if match.group("limit") else None,
+        "dimensions": dimensions,
+        "measures": measures,
+        # The query without ORDER BY and LIMIT, whose answer does not depend on ties
+        "core_sql": sql[:max(match.end("source"), match.end("where"), match.end("group"))],
+    }
+
+
+# Function to write a filter on a rollup column so SQLite gives the database's answer, or None when it can't
+def _filter(column: str, kind: str, collation: str, operator: str, value: str) -> str:
+    if operator in ("IS", "IS NOT"):
+        return f"{column} {operator} {value}" if value.strip().upper() == "NULL" else None
+    literals = [literal for literal in _FILTER_LITERAL_RE.findall(value) if literal.upper() != "NULL"]
+    if not literals or "LIKE" in operator and kind != "text":
+        return None
+    if kind in ("integer", "real"):
+        # A quoted number is converted by the column's numeric affinity, as MySQL converts it
+        if all(_NUMBER_RE.fullmatch(literal.strip("'")) for literal in literals):
+            return f"{column} {operator} {value}"
+    elif kind == "date":
+        if all(literal[0] == "'" and _DATE_RE.fullmatch(literal[1:-1]) for literal in literals):
+            return f"{column} {operator} {value}"
+    elif kind == "text" and collation in ("nocase", "binary"):
+        for literal in literals:
+            # Backslash escapes and trailing spaces (ignored by PAD SPACE collations) are read differently
+            if literal[0] != "'" or "\\" in literal or literal[1:-1].endswith(" "):
+                return None
+            if collation == "nocase" and not literal.isascii():
+                return None
+        # SQLite's LIKE ignores ASCII case, like a case-insensitive collation and unlike a binary one
+        if "LIKE" in operator:
+            return f"{column} {operator} {value}" if collation == "nocase" else None
+        if operator in _EQUALITY_OPERATORS:
+            return f"{column}{' COLLATE NOCASE' if collation == 'nocase' else ''} {operator} {value}"
+    return None
+
+
+# Function to write the query that answers a parsed aggregate query from a rollup, or None if it doesn't cover it
+def rewrite(shape: dict, rollup: dict, table: str = None, core: bool = False) -> str:
+    if not set(shape["dimensions"]) <= set(rollup["dimensions"]) or not set(shape["measures"]) <= set(rollup["measures"]):
+        return None
+    # Rollups built before dimensions were typed have none: their filters are not rewritten
+    kinds, collations = rollup.get("kinds", {}), rollup.get("collations", {})
+    filters = []
+    for column, operator, value in shape["where"]:
+        filters.append(_filter(f"d{list(rollup['dimensions']).index(column)}", kinds.get(column),
+                               collations.get(column), operator, value))
+        if filters[-1] is None:
+            return None
+    # Strings sort by collation, which SQLite doesn't follow: a LIMIT could keep other rows
+    if shape["limit"] is not None and any(
+            shape["items"][i]["kind"] == "dimension" and kinds.get(shape["items"][i]["column"]) not in
+            ("integer", "real", "date") for i, _ in shape["order"]):
+        return None
+    d = {key: f"d{i}" for i, key in enumerate(rollup["dimensions"])}
+    m = {key: f"m{i}" for i, key in enumerate(rollup["measures"])}
+    select = []
+    for item in shape["items"]:
+        if item["kind"] == "dimension":
+            expression = d[item["column"]]
+        elif item["distinct"]:
+            expression = f"COUNT(DISTINCT {d[item['argument']]})"
+        elif item["function"] == "avg":
+            expression = f"SUM({m['sum:' + item['argument']]}) * 1.0 / SUM({m['count:' + item['argument']]})"
+        elif item["function"] == "count":
+            # Counts over no rows at all are 0, not NULL
+            expression = f"COALESCE(SUM({m['count:' + item['argument']]}), 0)"
+        else:
+            measure = m[f"{item['function']}:{item['argument']}"]
+            expression = f"{item['function'].upper()}({measure})"
+        select.append(f"{expression} AS {_quote(item['name'])}")
+    sql = f"SELECT {', '.join(select)} FROM {_quote(table or rollup['table'])}"
+    if filters:
+        sql += " WHERE " + " AND ".join(filters)
+    if shape["group"]:
+        sql += " GROUP BY " + ", ".join(d[column] for column in shape["group"])
+    if core:
+        return sql
+    if shape["order"]:
+        sql += " ORDER BY " + ", ".join(f"{_quote(shape['items'][i]['name'])} {direction}" for i, direction in shape["order"])
+    if shape["limit"] is not None:
+        sql += f" LIMIT {shape['limit']}"
+    return sql
+
+
+# Function to convert a database value into one SQLite can store (dates as their SQL text)
+def _to_sqlite(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (int, float, str, bytes)) or value is None:
+        return value
+    return str(value)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+# Function to name the kind of a database value: integer, real, text, date or other (None for NULL)
+def _kind(value) -> str:
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, (float, Decimal)):
+        return "real"
+    if isinstance(value, str):
+        return "text"
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return "date"
+    return "other"
+
+
+# Function to combine the kinds of two values of one column
+def _merge_kinds(a: str, b: str) -> str:
+    if a is None or a == b:
+        return b or a
+    if b is None:
+        return a
+    return "real" if {a, b} == {"integer", "real"} else "other"
+
+
+def _sort_key(row: tuple) -> list:
+    return [(0, "") if v is None else (1, round(float(v), 3)) if _is_number(v) else (2, str(_to_sqlite(v))) for v in row]
+
+
+# Function to compare two query results as multisets of rows, with numbers compared to 4 decimals
+def same_rows(left: list, right: list) -> bool:
+    if len(left) != len(right):
+        return False
+    for a, b in zip(sorted(left, key=_sort_key), sorted(right, key=_sort_key)):
+        for x, y in zip(a, b):
+            if _is_number(x) and _is_number(y):
+                if not math.isclose(float(x), float(y), rel_tol=1e-6, abs_tol=1e-4):
+                    return False
+            elif _to_sqlite(x) != _to_sqlite(y):
+                return False
+    return True
+
+
+class Rollups:
+    """The query log and the rollups of one database, kept in a SQLite sidecar file."""
+
+    def __init__(self, db: SQLDatabase, path: str, hot_queries: int = HOT_QUERIES, max_dimensions: int = MAX_DIMENSIONS,
+                 max_rows: int = MAX_ROLLUP_ROWS, max_age: float = MAX_AGE):
+        self.db = db
+        self.path = path
+        self.hot_queries = hot_queries
+        self.max_dimensions = max_dimensions
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._conn = None
+        self._rollups = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_log ("
+                " shape TEXT PRIMARY KEY, source_key TEXT NOT NULL, source TEXT NOT NULL, tables TEXT NOT NULL,"
+                " dimensions TEXT NOT NULL, measures TEXT NOT NULL, sample_sql TEXT NOT NULL,"
+                " count INTEGER NOT NULL, last_seen REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rollups ("
+                " source_key TEXT PRIMARY KEY, rollup TEXT NOT NULL, status TEXT NOT NULL, built_at REAL NOT NULL)"
+            )
+            self._rollups = {
+                source_key: dict(json.loads(rollup), status=status, built_at=built_at)
+                for source_key, rollup, status, built_at in self._conn.execute(
+                    "SELECT source_key, rollup, status, built_at FROM rollups")
+            }
+        return self._conn
+
+    def record(self, sql: str) -> bool:
+        """Log an executed query; returns False for queries that are not a rollup shape."""
+        shape = parse_aggregate(sql)
+        if shape is None:
+            return False
+        key = hashlib.sha1(json.dumps(
+            [shape["source_key"], sorted(shape["dimensions"]), sorted(shape["measures"])]).encode()).hexdigest()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO query_log (shape, source_key, source, tables, dimensions, measures, sample_sql, count,"
+                " last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?) ON CONFLICT (shape) DO UPDATE SET"
+                " count = count + 1, last_seen = excluded.last_seen, sample_sql = excluded.sample_sql",
+                (key, shape["source_key"], shape["source"], json.dumps(shape["tables"]),
+                 json.dumps(shape["dimensions"]), json.dumps(shape["measures"]), sql, time.time()),
+            )
+            conn.commit()
+        return True
+
+    def plan(self) -> list:
+        """Pick the rollups to have: one per hot FROM clause, over the columns of its most frequent shapes."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT source_key, source, tables, dimensions, measures, sample_sql, count, last_seen FROM query_log"
+                " WHERE last_seen > ? ORDER BY count DESC, last_seen DESC",
+                (time.time() - LOG_WINDOW,),
+            ).fetchall()
+        totals = {}
+        for source_key, *_, count, last_seen in rows:
+            totals[source_key] = totals.get(source_key, 0) + count
+        plans = {}
+        for source_key, source, tables, dimensions, measures, sample_sql, count, last_seen in rows:
+            if totals[source_key] < self.hot_queries:
+                continue
+            plan = plans.setdefault(source_key, {
+                "source_key": source_key, "source": source, "tables": json.loads(tables),
+                "dimensions": {}, "measures": {}, "samples": [], "last_seen": 0.0,
+            })
+            plan["last_seen"] = max(plan["last_seen"], last_seen)
+            dimensions = {**plan["dimensions"], **json.loads(dimensions)}
+            if len(dimensions) > self.max_dimensions:
+                continue
+            plan["dimensions"] = dimensions
+            plan["measures"].update(json.loads(measures))
+            plan["samples"].append(sample_sql)
+        for plan in plans.values():
+            # Sorted, so the same shapes always give the same rollup
+            plan["dimensions"] = dict(sorted(plan["dimensions"].items()))
+            plan["measures"] = dict(sorted(plan["measures"].items()))
+            plan["signature"] = hashlib.sha1(
+                json.dumps([plan["source_key"], list(plan["dimensions"]), list(plan["measures"])]).encode()
+            ).hexdigest()[:16]
+        return [plan for plan in plans.values() if plan["samples"]]
+
+    def _versions(self, tables: list) -> dict:
+        versions = catalog.versions(self.db)
+        return {table: versions[table][0] if table in versions else None for table in tables}
+
+    def _is_fresh(self, rollup: dict) -> bool:
+        if self._versions(rollup["tables"]) != rollup["versions"]:
+            return False
+        # Without a data version (e.g. SQLite, or an unknown table) fall back to a maximum age
+        trackable = all(version not in (None, "", "None") for version in rollup["versions"].values())
+        return trackable or time.time() - rollup["built_at"] < self.max_age
+
+    def _save(self, rollup: dict, status: str, built_at: float):
+        fields = {k: v for k, v in rollup.items() if k not in ("status", "built_at", "samples", "last_seen")}
+        self._connection().execute(
+            "INSERT OR REPLACE INTO rollups (source_key, rollup, status, built_at) VALUES (?, ?, ?, ?)",
+            (rollup["source_key"], json.dumps(fields), status, built_at),
+        )
+        self._rollups[rollup["source_key"]] = dict(fields, status=status, built_at=built_at)
+
+    def _verify(self, plan: dict, table: str) -> bool:
+        # The core queries (no ORDER BY/LIMIT) are compared, as ties may come back in any order
+        for sample_sql in plan["samples"][:VERIFY_QUERIES]:
+            shape = parse_aggregate(sample_sql)
+            rollup_sql = rewrite(shape, plan, table=table, core=True) if shape is not None else None
+            if rollup_sql is None:
+                continue
+            with connect_with_timeout(self.db, BUILD_TIMEOUT) as conn:
+                expected = [tuple(row) for row in conn.execute(text(shape["core_sql"])).fetchmany(MAX_ROWS + 1)]
+            with self._lock:
+                actual = self._connection().execute(rollup_sql).fetchmany(MAX_ROWS + 1)
+            if len(expected) > MAX_ROWS or len(actual) > MAX_ROWS:
+                continue
+            if not same_rows(expected, actual):
+                logger.warning("rollup of %s gives a different answer than the base tables for: %s",
+                               plan["source"], sample_sql)
+                return False
+        return True
+
+    def _collations(self, conn, plan: dict, kinds: list, ascii_only: list) -> dict:
+        """How each text dimension compares: "nocase", "binary", or None when SQLite can't follow it."""
+        collations = {}
+        for i, (key, expression) in enumerate(plan["dimensions"].items()):
+            if kinds[i] != "text":
+                continue
+            collation = None
+            if self.db.dialect in ("sqlite", "postgresql"):
+                collation = "binary"
+            elif self.db.dialect == "mysql":
+                name = conn.execute(text(f"SELECT COLLATION({expression}) FROM {plan['source']} LIMIT 1")).scalar() or ""
+                if name.endswith("_ci") and ascii_only[i]:
+                    collation = "nocase"
+                elif name.endswith(("_bin", "_cs")):
+                    collation = "binary"
+            collations[key] = collation
+        return collations
+
+    def build(self, plan: dict, verify: bool = True) -> str:
+        """Build (or rebuild) the rollup for a plan and swap it in; returns its status."""
+        table = "rollup_" + hashlib.sha1(plan["source_key"].encode()).hexdigest()[:12]
+        rollup = dict(plan, table=table)
+        # Read before the data, so a change during the build leaves the rollup stale rather than wrong
+        rollup["versions"] = self._versions(plan["tables"])
+        columns = [f"{expression} AS d{i}" for i, expression in enumerate(plan["dimensions"].values())]
+        columns += [f"{function.upper()}({argument}) AS m{i}" for i, (function, argument) in enumerate(plan["measures"].values())]
+        build_sql = f"SELECT {', '.join(columns)} FROM {plan['source']}"
+        if plan["dimensions"]:
+            build_sql += " GROUP BY " + ", ".join(plan["dimensions"].values())
+        # One row more than a rollup may have, so a too large one is told apart without reading it all
+        build_sql += f" LIMIT {self.max_rows + 1}"
+        started, rows, status = time.perf_counter(), [], "ready"
+        try:
+            check_cost(self.db, build_sql)
+        except QueryTooExpensiveError:
+            status = "too_expensive"
+        dimensions = len(plan["dimensions"])
+        kinds, ascii_only, padded = [None] * dimensions, [True] * dimensions, [False] * dimensions
+        # A build can take longer than the statement timeout meant for the chat's queries, but not forever
+        with connect_with_timeout(self.db, BUILD_TIMEOUT) as conn:
+            result = conn.execution_options(stream_results=True).execute(text(build_sql)) if status == "ready" else None
+            while status == "ready":
+                batch = result.fetchmany(BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    for i, value in enumerate(row[:dimensions]):
+                        kinds[i] = _merge_kinds(kinds[i], _kind(value))
+                        if isinstance(value, str):
+                            ascii_only[i] = ascii_only[i] and value.isascii()
+                            padded[i] = padded[i] or value.endswith(" ")
+                    rows.append(tuple(_to_sqlite(value) for value in row))
+                if len(rows) > self.max_rows:
+                    status = "too_large"
+            if result is not None:
+                result.close()
+            if status == "ready":
+                # Strings with trailing spaces compare differently under PAD SPACE collations
+                kinds = ["other" if pad else kind for kind, pad in zip(kinds, padded)]
+                rollup["collations"] = self._collations(conn, plan, kinds, ascii_only)
+        rollup["kinds"] = dict(zip(plan["dimensions"], kinds))
+        count_column = len(plan["dimensions"]) + list(plan["measures"]).index("count:*")
+        rollup["base_rows"] = sum(row[count_column] or 0 for row in rows)
+        rollup["rows"] = len(rows)
+        if status == "ready" and rollup["base_rows"] < MIN_REDUCTION * len(rows):
+            status = "not_smaller"
+        if status == "ready":
+            # Typed dimensions, so comparisons get the column's affinity (e.g. Year = '2010' is numeric)
+            names = [f"d{i} {_COLUMN_TYPES.get(kind, '')}".strip() for i, kind in enumerate(kinds)]
+            names += [f"m{i}" for i in range(len(plan["measures"]))]
+            with self._lock:
+                conn = self._connection()
+                conn.execute(f"DROP TABLE IF EXISTS {table}_new")
+                conn.execute(f"CREATE TABLE {table}_new ({', '.join(names)})")
+                conn.executemany(f"INSERT INTO {table}_new VALUES ({', '.join('?' * len(names))})", rows)
+                conn.commit()
+            if verify and not self._verify(rollup, f"{table}_new"):
+                status = "wrong_answers"
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            if status == "ready":
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+            else:
+                conn.execute(f"DROP TABLE IF EXISTS {table}_new")
+            self._save(rollup, status, time.time())
+            conn.commit()
+        elapsed = time.perf_counter() - started
+        metrics.inc("sqlbot_rollup_builds_total", status=status)
+        metrics.observe("sqlbot_rollup_build_seconds", elapsed)
+        logger.info("rollup of %s: %s, %d rows for %d base rows in %.2fs",
+                    plan["source"], status, rollup["rows"], rollup["base_rows"], elapsed)
+        return status
+
+    def maintain(self) -> dict:
+        """Build rollups for newly hot shapes and rebuild stale ones; returns ``{source: status}``."""
+        built = {}
+        # One maintenance run at a time, even if called by hand while the scheduler runs
+        with self._build_lock:
+            for plan in self.plan():
+                with self._lock:
+                    self._connection()
+                    current = self._rollups.get(plan["source_key"])
+                same = current is not None and current["signature"] == plan["signature"]
+                # A stale rollup is only rebuilt once a query asks for it again, not on every run
+                if same and current["status"] == "ready" and (
+                        plan["last_seen"] <= current["built_at"] or self._is_fresh(current)):
+                    continue
+                if same and current["status"] != "ready" and time.time() - current["built_at"] < RETRY_AFTER:
+                    continue
+                try:
+                    built[plan["source"]] = self.build(plan)
+                except Exception:
+                    logger.exception("could not build the rollup of %s", plan["source"])
+                    # Saved like the other dropped rollups, so the build waits RETRY_AFTER before the next try
+                    with self._lock:
+                        self._save(plan, "failed", time.time())
+                        self._connection().commit()
+                    metrics.inc("sqlbot_rollup_builds_total", status="failed")
+                    built[plan["source"]] = "failed"
+        return built
+
+    def run(self, sql: str, max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES) -> QueryResult:
+        """Answer an aggregate query from a fresh rollup that covers it; None when the database has to."""
+        shape = parse_aggregate(sql)
+        if shape is None:
+            return None
+        with self._lock:
+            self._connection()
+            rollup = self._rollups.get(shape["source_key"])
+        rollup_sql = None
+        if rollup is not None and rollup["status"] == "ready" and self._is_fresh(rollup):
+            rollup_sql = rewrite(shape, rollup)
+        if rollup_sql is None:
+            self.misses += 1
+            record_cache("rollup", False)
+            return None
+        with span("rollup", table=rollup["table"]) as attributes:
+            with self._lock:
+                cursor = self._connection().execute(rollup_sql)
+                result = QueryResult([column[0] for column in cursor.description])
+                while True:
+                    batch = cursor.fetchmany(BATCH_SIZE)
+                    if not batch or not result.extend(batch, max_rows, max_bytes):
+                        break
+                cursor.close()
+            attributes["rows"] = result.row_count
+        self.hits += 1
+        record_cache("rollup", True)
+        return result
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            self._connection()
+            statuses = [rollup["status"] for rollup in self._rollups.values()]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "rollups": statuses.count("ready"),
+            "dropped": len(statuses) - statuses.count("ready"),
+        }
+
+
+# Function to get the rollups of a database, starting the refresh scheduler with the first one
+def get_rollups(db: SQLDatabase) -> Rollups:
+    key = database_key(db)
+    with _lock:
+        rollups = _instances.get(key)
+        if rollups is None:
+            name = hashlib.sha1(key.encode()).hexdigest()[:16]
+            rollups = Rollups(db, os.path.join(CACHE_DIR, "rollups", f"{name}.sqlite3"))
+            _instances[key] = rollups
+    start_scheduler()
+    return rollups
+
+
+# Function to start the background thread that keeps the rollups of every database up to date
+def start_scheduler(interval: float = REFRESH_INTERVAL) -> threading.Thread:
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_maintain_forever, args=(interval,), name="sqlbot-rollups", daemon=True)
+            _scheduler.start()
+        return _scheduler
+
+
+def _maintain_forever(interval: float):
+    while True:
+        time.sleep(interval)
+        with _lock:
+            instances = list(_instances.values())
+        for rollups in instances:
+            try:
+                rollups.maintain()
+            except Exception:
+                logger.exception("rollup maintenance failed")
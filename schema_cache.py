@@ -0,0 +1,214 @@
+"""Process-wide cache of the schema text that goes into the prompts.
+
+Streamlit re-executes the app script on every interaction, but imported modules stay
+loaded, so the catalog kept at module level here is shared by every browser session
+that talks to the same database.
+"""
+import hashlib
+import threading
+import time
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from tracing import record_cache
+
+
+# Queries used to detect data and DDL changes, keyed by SQLAlchemy dialect name
+_MYSQL_TABLES_QUERY = """
+    SELECT TABLE_NAME, UPDATE_TIME, CREATE_TIME
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = DATABASE()
+"""
+_MYSQL_COLUMNS_QUERY = """
+    SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+_SQLITE_TABLES_QUERY = "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'view')"
+
+
+# Function to build the cache key for a database: its connection URI without the password
+def database_key(db: SQLDatabase) -> str:
+    return db._engine.url.render_as_string(hide_password=True)
+
+
+# Function to read a (data_version, ddl_version) pair for every table in the database
+def table_versions(db: SQLDatabase) -> dict:
+    dialect = db.dialect
+    versions = {}
+    with db._engine.connect() as conn:
+        if dialect == "mysql":
+            try:
+                # MySQL 8 serves UPDATE_TIME from a statistics cache refreshed once a day by default
+                conn.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+            except DBAPIError:
+                # MySQL 5.7 and MariaDB have no such cache
+                pass
+            columns = {}
+            for table, column, column_type, nullable, key in conn.execute(text(_MYSQL_COLUMNS_QUERY)):
+                columns.setdefault(table, []).append(f"{column}:{column_type}:{nullable}:{key}")
+            for table, update_time, create_time in conn.execute(text(_MYSQL_TABLES_QUERY)):
+                ddl = hashlib.sha1("|".join(columns.get(table, [])).encode()).hexdigest()
+                versions[table] = (str(update_time), f"{create_time}:{ddl}")
+        elif dialect == "sqlite":
+            # SQLite keeps no per-table modification time, so only DDL changes are detected
+            for table, sql in conn.execute(text(_SQLITE_TABLES_QUERY)):
+                versions[table] = ("", hashlib.sha1((sql or "").encode()).hexdigest())
+    return versions
+
+
+class _CatalogEntry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.versions = None
+        self.table_info = {}
+        self.checked_at = 0.0
+        self.built_at = time.monotonic()
+
+
+class SchemaCatalog:
+    """Caches ``db.get_table_info()`` per table, keyed by connection URI.
+
+    The cached text for a table is dropped when its ``UPDATE_TIME`` (sample rows) or its
+    DDL changes. Version checks are rate limited to one every ``check_interval`` seconds,
+    and everything is rebuilt after ``max_age`` seconds for dialects without change
+    tracking. Tables created or dropped since the ``SQLDatabase`` was built are added to
+    (or removed from) its table list, as the shared database object is never rebuilt.
+    """
+
+    def __init__(self, check_interval: float = 5.0, max_age: float = 3600.0):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, db: SQLDatabase) -> _CatalogEntry:
+        key = database_key(db)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = _CatalogEntry()
+            return self._entries[key]
+
+    def _refresh(self, db: SQLDatabase, entry: _CatalogEntry):
+        now = time.monotonic()
+        if now - entry.built_at >= self.max_age:
+            entry.table_info.clear()
+            entry.built_at = now
+        if entry.versions is not None and now - entry.checked_at < self.check_interval:
+            return
+        versions = table_versions(db)
+        old_versions = entry.versions or {}
+        if entry.versions is None or set(versions) != set(old_versions):
+            refresh_table_names(db, set(versions))
+        for table, (data_version, ddl_version) in versions.items():
+            if table not in old_versions:
+                continue
+            old_data, old_ddl = old_versions[table]
+            if old_ddl != ddl_version:
+                _reflect_table(db, table)
+            if (old_data, old_ddl) != (data_version, ddl_version):
+                entry.table_info.pop(table, None)
+        for table in set(old_versions) - set(versions):
+            entry.table_info.pop(table, None)
+        entry.versions = versions
+        entry.checked_at = now
+
+    def versions(self, db: SQLDatabase) -> dict:
+        """Return the current ``(data_version, ddl_version)`` of every table."""
+        entry = self._entry(db)
+        with entry.lock:
+            self._refresh(db, entry)
+            return dict(entry.versions)
+
+    def fingerprint(self, db: SQLDatabase, include_data: bool = True) -> str:
+        """Return a short hash that changes whenever the schema text would change.
+
+        With ``include_data=False`` only DDL changes are taken into account, which is what
+        callers caching generated SQL (rather than data) want.
+        """
+        versions = self.versions(db)
+        payload = "|".join(
+            f"{t}={d if include_data else ''}:{v}" for t, (d, v) in sorted(versions.items())
+        )
+        return hashlib.sha1(f"{database_key(db)}#{payload}".encode()).hexdigest()[:16]
+
+    def get_table_infos(self, db: SQLDatabase, table_names: list = None) -> dict:
+        """Return ``{table_name: table_info}`` for the given tables (all usable tables by default)."""
+        entry = self._entry(db)
+        with entry.lock:
+            self._refresh(db, entry)
+            names = list(table_names) if table_names else sorted(db.get_usable_table_names())
+            missing = [name for name in names if name not in entry.table_info]
+            if missing:
+                self.misses += 1
+                record_cache("schema", False)
+                for name in missing:
+                    entry.table_info[name] = db.get_table_info([name])
+            else:
+                self.hits += 1
+                record_cache("schema", True)
+            return {name: entry.table_info[name] for name in names}
+
+    def get_table_info(self, db: SQLDatabase, table_names: list = None) -> str:
+        return "\n\n".join(self.get_table_infos(db, table_names).values())
+
+    def invalidate(self, db: SQLDatabase = None):
+        """Forget cached schema text for one database, or for all of them."""
+        with self._lock:
+            if db is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(database_key(db), None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "databases": len(self._entries),
+        }
+
+
+# Function to bring the database's table list up to date; tables, when given, are the names the versions
+# query just reported, and nothing is read from the database if they are the ones already known
+def refresh_table_names(db: SQLDatabase, tables: set = None):
+    if tables is not None and (not tables or tables == db._all_tables):
+        return
+    inspector = inspect(db._engine)
+    names = set(inspector.get_table_names(schema=db._schema))
+    if db._view_support:
+        names |= set(inspector.get_view_names(schema=db._schema))
+    if names == db._all_tables:
+        return
+    added, removed = names - db._all_tables, db._all_tables - names
+    db._all_tables = names
+    usable = db.get_usable_table_names()
+    db._usable_tables = set(usable) if usable else db._all_tables
+    for table in list(db._metadata.sorted_tables):
+        if table.name in removed:
+            db._metadata.remove(table)
+    added &= db._usable_tables
+    if added:
+        db._metadata.reflect(bind=db._engine, only=sorted(added), schema=db._schema, views=db._view_support)
+
+
+# Function to re-reflect a table whose DDL changed, so get_table_info() sees the new columns
+def _reflect_table(db: SQLDatabase, table_name: str):
+    for table in list(db._metadata.sorted_tables):
+        if table.name == table_name:
+            db._metadata.remove(table)
+    db._metadata.reflect(bind=db._engine, only=[table_name], schema=db._schema)
+
+
+# Shared catalog used by all the Streamlit entry points
+catalog = SchemaCatalog()
+
+
+def get_table_info(db: SQLDatabase, table_names: list = None) -> str:
+    return catalog.get_table_info(db, table_names)
@@ -0,0 +1,113 @@
+"""Relevance-pruned schema for the prompts.
+
+Instead of sending every table to the LLM, each table's ``get_table_info()`` text (which
+already carries the column names, comments and sample rows) is indexed with BM25, and
+only the best matching tables plus their join neighbours are sent, within a token budget.
+"""
+import threading
+
+from langchain_community.utilities import SQLDatabase
+from langchain_core.messages import HumanMessage
+
+from schema_cache import catalog, database_key
+from text_index import BM25Index, estimate_tokens, tokenize
+
+
+TOP_K = 4
+TOKEN_BUDGET = 3000
+# Column name suffixes that usually mark a join key even without a declared foreign key
+_KEY_SUFFIXES = ("_id", "_number", "_no", "_code", "_key")
+
+
+class SchemaIndex:
+    def __init__(self, table_infos: dict, neighbours: dict):
+        self.tables = list(table_infos)
+        self.table_infos = table_infos
+        self.neighbours = neighbours
+        self.tokens = {name: estimate_tokens(info) for name, info in table_infos.items()}
+        # Table names are repeated so that a question naming a table ranks it first
+        self._bm25 = BM25Index([f"{name} {name} {info}" for name, info in table_infos.items()])
+
+    def select(self, query: str, top_k: int = TOP_K, token_budget: int = TOKEN_BUDGET) -> list:
+        """Return the names of the tables to send for ``query``, or [] if nothing matched."""
+        hits = [self.tables[i] for i, _ in self._bm25.search(query, top_k)]
+        candidates = list(hits)
+        for name in hits:
+            candidates.extend(n for n in self.neighbours.get(name, ()) if n not in candidates)
+        selected, used = [], 0
+        for name in candidates:
+            if selected and used + self.tokens[name] > token_budget:
+                continue
+            selected.append(name)
+            used += self.tokens[name]
+        return selected
+
+
+# Function to find the tables joined to each table, by foreign key or by a shared key column
+def _find_neighbours(db: SQLDatabase, table_names: list) -> dict:
+    tables = {table.name: table for table in db._metadata.sorted_tables if table.name in table_names}
+    neighbours = {name: set() for name in tables}
+    key_columns = {}
+    for name, table in tables.items():
+        for fk in table.foreign_keys:
+            other = fk.column.table.name
+            if other in neighbours and other != name:
+                neighbours[name].add(other)
+                neighbours[other].add(name)
+        for column in table.columns:
+            column_name = column.name.lower()
+            if column_name == "id":
+                # Every table has its own "id"; sharing the name says nothing about joins
+                continue
+            if column.primary_key or column.foreign_keys or column_name.endswith(_KEY_SUFFIXES):
+                key_columns.setdefault(column_name, set()).add(name)
+    for name, table in tables.items():
+        for column in table.columns:
+            for other in key_columns.get(column.name.lower(), ()):
+                if other != name:
+                    neighbours[name].add(other)
+                    neighbours[other].add(name)
+    return {name: sorted(others) for name, others in neighbours.items()}
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+# Function to get the index for the current schema version, building it on first use
+def get_schema_index(db: SQLDatabase) -> SchemaIndex:
+    key = (database_key(db), catalog.fingerprint(db))
+    with _lock:
+        index = _indexes.get(key)
+    if index is None:
+        table_infos = catalog.get_table_infos(db)
+        index = SchemaIndex(table_infos, _find_neighbours(db, list(table_infos)))
+        with _lock:
+            # Drop indexes built for older versions of the same database
+            for old_key in [k for k in _indexes if k[0] == key[0]]:
+                del _indexes[old_key]
+            _indexes[key] = index
+    return index
+
+
+# Function to build the search text: the question plus the user's previous message for follow-ups
+def _search_text(question: str, chat_history: list = None) -> str:
+    previous = [m.content for m in (chat_history or []) if isinstance(m, HumanMessage)]
+    # The history already ends with the current question when called from the Streamlit apps
+    if previous and previous[-1] == question:
+        previous = previous[:-1]
+    return " ".join([question] + previous[-1:])
+
+
+# Function to get the schema text for the tables relevant to a question
+def get_relevant_schema(db: SQLDatabase, question: str, chat_history: list = None,
+                        top_k: int = TOP_K, token_budget: int = TOKEN_BUDGET) -> str:
+    index = get_schema_index(db)
+    full_tokens = sum(index.tokens.values())
+    if full_tokens <= token_budget or not tokenize(question):
+        return catalog.get_table_info(db)
+    selected = index.select(_search_text(question, chat_history), top_k, token_budget)
+    if not selected:
+        # Nothing matched: fall back to the full schema rather than guess
+        return catalog.get_table_info(db)
+    return "\n\n".join(index.table_infos[name] for name in selected)
@@ -0,0 +1,219 @@
+"""Persistent question -> SQL cache placed in front of the SQL-generation chain.
+
+Entries live in a SQLite file so they survive restarts and are shared by every session
+of the process (and by other processes using the same file). A lookup first tries an
+exact match on the normalized question, then optionally (``SQLBOT_NEAR_DUPLICATE_THRESHOLD``,
+off by default) a near-duplicate match: a question with the same content words, only
+reordered or with other stopwords, whose similarity score reaches the threshold.
+
+Entries are keyed on the DDL fingerprint of the database and on a ``scope``: a hash of the
+SQL prompt template and the models writing the SQL (see ``prompt_scope``). A schema change
+never serves SQL written for the old schema, and an edited prompt, another model or another
+app on the same database never serves SQL written by a different one.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from langchain_community.utilities import SQLDatabase
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from schema_cache import catalog
+from text_index import similarity, tokenize
+from tracing import record_cache
+
+
+CACHE_DIR = os.getenv("SQLBOT_CACHE_DIR", ".cache")
+_FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|that|this|those|these|them|they|same|above|previous|instead|also|again|now|"
+    r"what about|how about|and for|only)\b"
+)
+_NUMBER_RE = re.compile(r"\d+")
+# 0 turns near-duplicate matching off: a question differing by one word ("excluding") can need other SQL
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("SQLBOT_NEAR_DUPLICATE_THRESHOLD", "0"))
+
+
+# Function to normalize a question so trivial differences (case, spacing, "?") share an entry
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?.!")
+
+
+# Function to name what the SQL for a question depends on besides the schema: the SQL prompt and the models
+def prompt_scope(template: str, *models) -> str:
+    names = [getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+             for model in models if model is not None]
+    return hashlib.sha1("\x00".join([template, *names]).encode()).hexdigest()[:16]
+
+
+# Function to get the conversation context a question depends on ("" for standalone questions)
+def question_context(question: str, chat_history: list = None) -> str:
+    normalized = normalize_question(question)
+    if len(tokenize(normalized)) >= 3 and not _FOLLOW_UP_RE.search(normalized):
+        return ""
+    previous = [m.content for m in (chat_history or []) if isinstance(m, HumanMessage)]
+    if previous and previous[-1] == question:
+        previous = previous[:-1]
+    return normalize_question(previous[-1]) if previous else ""
+
+
+class SQLCache:
+    """LRU/TTL cache of generated SQL backed by a SQLite file."""
+
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "sql_cache.sqlite3"), max_entries: int = 5000,
+                 ttl: float = 7 * 24 * 3600, near_duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, context TEXT NOT NULL,"
+                " question TEXT NOT NULL, sql TEXT NOT NULL, created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sql_cache_scope ON sql_cache (fingerprint, context)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sql_cache_lru ON sql_cache (last_used)")
+        return self._conn
+
+    @staticmethod
+    def _key(fingerprint: str, context: str, question: str) -> str:
+        return hashlib.sha1(f"{fingerprint}\x00{context}\x00{question}".encode()).hexdigest()
+
+    def get(self, fingerprint: str, question: str, context: str = "") -> str:
+        """Return the cached SQL for the question, or None."""
+        question = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT key, sql FROM sql_cache WHERE key = ? AND created_at > ?",
+                (self._key(fingerprint, context, question), now - self.ttl),
+            ).fetchone()
+            if row is None and self.near_duplicate_threshold:
+                row = self._near_duplicate(conn, fingerprint, context, question, now)
+                if row is not None:
+                    self.near_hits += 1
+            if row is None:
+                self.misses += 1
+                record_cache("sql", False)
+                return None
+            self.hits += 1
+            record_cache("sql", True)
+            conn.execute("UPDATE sql_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, row[0]))
+            conn.commit()
+            return row[1]
+
+    def _near_duplicate(self, conn, fingerprint: str, context: str, question: str, now: float):
+        numbers = _NUMBER_RE.findall(question)
+        terms = set(tokenize(question))
+        best, best_score = None, self.near_duplicate_threshold
+        rows = conn.execute(
+            "SELECT key, sql, question FROM sql_cache WHERE fingerprint = ? AND context = ? AND created_at > ?",
+            (fingerprint, context, now - self.ttl),
+        )
+        for key, sql, cached_question in rows:
+            # "top 5" and "top 10" look alike but need different SQL
+            if _NUMBER_RE.findall(cached_question) != numbers:
+                continue
+            # Every content word counts, negations ("not", "excluding") included
+            if set(tokenize(cached_question)) != terms:
+                continue
+            score = similarity(question, cached_question)
+            if score >= best_score:
+                best, best_score = (key, sql), score
+        return best
+
+    def put(self, fingerprint: str, question: str, sql: str, context: str = ""):
+        question = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO sql_cache (key, fingerprint, context, question, sql, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(fingerprint, context, question), fingerprint, context, question, sql, now, now),
+            )
+            conn.execute("DELETE FROM sql_cache WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM sql_cache WHERE key IN ("
+                " SELECT key FROM sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def forget(self, sql: str):
+        """Drop every entry that produced ``sql``, e.g. after it failed to execute."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM sql_cache WHERE sql = ?", (sql,))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM sql_cache")
+            conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Shared cache used by all the Streamlit entry points
+sql_cache = SQLCache()
+
+
+# Function to get what a question's cache entry is keyed on besides the question: (fingerprint, context)
+def cache_key(db: SQLDatabase, vars: dict, scope: str = "") -> tuple:
+    fingerprint = catalog.fingerprint(db, include_data=False)
+    if scope:
+        fingerprint = hashlib.sha1(f"{fingerprint}#{scope}".encode()).hexdigest()[:16]
+    return fingerprint, question_context(vars["question"], vars.get("chat_history"))
+
+
+# Function to put the SQL cache in front of a chain that turns {question, chat_history} into SQL;
+# scope (see prompt_scope) keeps apart the SQL written by different prompts and models
+def with_sql_cache(db: SQLDatabase, sql_chain, cache: SQLCache = None, scope: str = ""):
+    cache = cache or sql_cache
+
+    def lookup(vars: dict):
+        fingerprint, context = cache_key(db, vars, scope)
+        return fingerprint, context, cache.get(fingerprint, vars["question"], context)
+
+    def cached_sql(vars: dict, config=None) -> str:
+        fingerprint, context, sql = lookup(vars)
+        if sql is None:
+            sql = sql_chain.invoke(vars, config).strip()
+            cache.put(fingerprint, vars["question"], sql, context)
+        return sql
+
+    async def acached_sql(vars: dict, config=None) -> str:
+        fingerprint, context, sql = await asyncio.to_thread(lookup, vars)
+        if sql is None:
+            sql = (await sql_chain.ainvoke(vars, config)).strip()
+            await asyncio.to_thread(cache.put, fingerprint, vars["question"], sql, context)
+        return sql
+
+    return RunnableLambda(cached_sql, afunc=acached_sql)
@@ -0,0 +1,197 @@
+"""Checks that generated SQL has to pass before it is run on the database.
+
+``prepare_sql`` is static: it strips Markdown fences, rejects anything but a single
+read-only statement and adds a LIMIT where the query has none. ``check_cost`` asks the
+database for its plan (``EXPLAIN``) and refuses queries estimated to examine more rows
+than ``MAX_EXAMINED_ROWS``. Rejected queries raise a ``GuardError`` whose message is
+written to be fed back to the LLM for a corrected query (see ``SQLPipeline``).
+"""
+import json
+import os
+import re
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from result_fetch import MAX_ROWS
+from tracing import span
+
+
+MAX_EXAMINED_ROWS = int(os.getenv("SQLBOT_MAX_EXAMINED_ROWS", "10000000"))
+# One more row than fetch_result keeps, so it can still tell that the result was truncated
+DEFAULT_LIMIT = MAX_ROWS + 1
+
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_COMMENT_RE = re.compile(r"--[^\n]*|#[^\n]*|/\*.*?\*/", re.S)
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?|\n?\s*```\s*$")
+_QUERY_RE = re.compile(r"^\s*\(*\s*(select|with)\b", re.I)
+_INSPECT_RE = re.compile(r"^\s*(show|describe|desc)\b", re.I)
+_WRITE_RE = re.compile(
+    r"\b(insert|update|delete|merge|upsert|drop|alter|create|truncate|rename|grant|revoke|call|"
+    r"into|for\s+update|for\s+share|lock\s+in\s+share\s+mode)\b",
+    re.I,
+)
+_FORBIDDEN_FUNCTION_RE = re.compile(r"\b(sleep|pg_sleep|benchmark|load_file)\s*\(", re.I)
+_TABLE_NAME_RE = re.compile(r"^(?:SCAN|SEARCH)\s+(?:TABLE\s+)?([`\"]?\w+[`\"]?)", re.I)
+_TABLE_REFERENCE_RE = re.compile(r"(?:\bfrom\b|\bjoin\b|,)\s*([`\"]?\w+[`\"]?)(?:\s+(?:as\s+)?([`\"]?\w+[`\"]?))?", re.I)
+_NOT_ALIASES = {"on", "using", "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural",
+                "straight_join", "group", "order", "limit", "having", "window", "union", "as"}
+
+
+class GuardError(ValueError):
+    """Raised for SQL that must not be run as it is."""
+
+
+class UnsafeQueryError(GuardError):
+    pass
+
+
+class QueryTooExpensiveError(GuardError):
+    pass
+
+
+# Function to blank out string literals and comments, so keywords are only matched in SQL code
+def _mask(sql: str) -> str:
+    parts = _LITERAL_RE.split(sql)
+    return "".join("''" if i % 2 else _COMMENT_RE.sub(" ", part) for i, part in enumerate(parts))
+
+
+# Function to tell whether the outermost query already has a LIMIT (or FETCH FIRST)
+def _has_limit(code: str) -> bool:
+    depth = 0
+    for token in re.finditer(r"[()]|\blimit\b|\bfetch\s+first\b", code, re.I):
+        if token.group() == "(":
+            depth += 1
+        elif token.group() == ")":
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+
+# Function to check that SQL is a single read-only statement and return it ready to run, with a LIMIT
+def prepare_sql(sql: str, limit: int = DEFAULT_LIMIT) -> str:
+    sql = _FENCE_RE.sub("", sql).strip()
+    code = _mask(sql).strip().rstrip(";").strip()
+    if not code:
+        raise UnsafeQueryError("The SQL query is empty.")
+    if ";" in code:
+        raise UnsafeQueryError("Only a single SQL statement can be run; remove every statement but the query.")
+    if _INSPECT_RE.match(code):
+        return sql
+    if not _QUERY_RE.match(code):
+        raise UnsafeQueryError("Only read-only SELECT queries can be run on this database.")
+    write = _WRITE_RE.search(code)
+    if write:
+        raise UnsafeQueryError(f"The query uses '{write.group().upper()}', but only read-only SELECT queries can be run.")
+    function = _FORBIDDEN_FUNCTION_RE.search(code)
+    if function:
+        raise UnsafeQueryError(f"The function {function.group(1).upper()}() is not allowed.")
+    sql = sql.rstrip().rstrip(";").rstrip()
+    if limit and not _has_limit(code):
+        # On its own line, so a trailing "--" comment cannot swallow it
+        sql = f"{sql}\nLIMIT {limit}"
+    return sql
+
+
+# Function to estimate how many rows MySQL will examine: rows multiply within a join, add up across selects
+def _mysql_estimate(conn, sql: str) -> int:
+    joins = {}
+    for row in conn.execute(text(f"EXPLAIN {sql}")).mappings():
+        rows = row.get("rows") or 1
+        joins[row.get("id")] = joins.get(row.get("id"), 1) * int(rows)
+    return sum(joins.values())
+
+
+# Function to map the table aliases of a query to their tables, e.g. {"c": "crimes"} for "FROM crimes AS c"
+def _table_aliases(sql: str) -> dict:
+    aliases = {}
+    for table, alias in _TABLE_REFERENCE_RE.findall(_mask(sql)):
+        if alias and alias.lower() not in _NOT_ALIASES:
+            aliases[alias.strip('`"').lower()] = table.strip('`"')
+    return aliases
+
+
+# Function to estimate the rows SQLite will examine from its query plan: each full scan multiplies by the table size
+def _sqlite_estimate(conn, sql: str) -> int:
+    estimate = 1
+    # The plan names a table by its alias when the query gives it one
+    aliases = _table_aliases(sql)
+    for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")):
+        detail = row[-1]
+        match = _TABLE_NAME_RE.match(detail)
+        if not match or "(" in match.group(1):
+            continue
+        table = match.group(1).strip('`"')
+        table = aliases.get(table.lower(), table)
+        if detail.upper().startswith("SCAN"):
+            estimate *= max(1, _sqlite_row_count(conn, table))
+        elif "AUTOMATIC" in detail.upper():
+            # Building the automatic index reads the table once
+            estimate += _sqlite_row_count(conn, table)
+    return estimate
+
+
+def _sqlite_row_count(conn, table: str) -> int:
+    # MAX(rowid) is a single b-tree lookup; COUNT(*) is the fallback for WITHOUT ROWID tables.
+    # Names that are not tables (a CTE, "CONSTANT ROW") count as 0.
+    for query in (f'SELECT MAX(rowid) FROM "{table}"', f'SELECT COUNT(*) FROM "{table}"'):
+        try:
+            return conn.execute(text(query)).scalar() or 0
+        except DBAPIError:
+            continue
+    return 0
+
+
+# Function to estimate the rows PostgreSQL expects at the largest node of the plan
+def _postgresql_estimate(conn, sql: str) -> int:
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes, largest = [plan[0]["Plan"]], 0
+    while nodes:
+        node = nodes.pop()
+        largest = max(largest, int(node.get("Plan Rows", 0)))
+        nodes.extend(node.get("Plans", []))
+    return largest
+
+
+_ESTIMATORS = {"mysql": _mysql_estimate, "sqlite": _sqlite_estimate, "postgresql": _postgresql_estimate}
+
+
+# Function to estimate how many rows a query will examine, or None when the database can't tell
+def estimate_rows(db: SQLDatabase, sql: str):
+    estimator = _ESTIMATORS.get(db.dialect)
+    if estimator is None or not _QUERY_RE.match(_mask(sql)):
+        return None
+    with db._engine.connect() as conn:
+        return estimator(conn, sql)
+
+
+# Function to refuse a query whose plan examines too many rows; returns the SQL unchanged otherwise
+def check_cost(db: SQLDatabase, sql: str, max_examined_rows: int = MAX_EXAMINED_ROWS) -> str:
+    if not max_examined_rows:
+        return sql
+    with span("explain") as attributes:
+        estimate = estimate_rows(db, sql)
+        attributes["estimated_rows"] = estimate or 0
+    if estimate is not None and estimate > max_examined_rows:
+        raise QueryTooExpensiveError(
+            f"The query plan would examine about {estimate:,} rows (the limit is {max_examined_rows:,}). "
+            "Join only on matching keys, filter earlier and aggregate in SQL instead of reading whole tables."
+        )
+    return sql
+
+
+# Function to tell whether a corrected query could fix an error (as opposed to e.g. a lost connection)
+def is_repairable(error: Exception) -> bool:
+    if isinstance(error, GuardError):
+        return True
+    return isinstance(error, DBAPIError) and not error.connection_invalidated
+
+
+# Function to describe an error for the LLM, without the SQLAlchemy boilerplate
+def describe_error(error: Exception, max_length: int = 500) -> str:
+    message = str(error.orig) if isinstance(error, DBAPIError) and error.orig is not None else str(error)
+    return message[:max_length]
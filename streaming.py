@@ -0,0 +1,150 @@
+"""Rendering of a streamed chat turn (see ``SQLPipeline.stream``) in a Streamlit chat message.
+
+Each stage is shown as soon as it is ready: the SQL query, the query execution as its own
+status step, then the answer token by token. Below it come the result (a chart for
+fast-path time series, see ``answer_policy``; fast-path tables are in the answer text), a
+collapsed "Timings" panel and a button to save the question and its SQL as an approved
+few-shot example.
+"""
+import math
+
+import streamlit as st
+from langchain_core.messages import AIMessage
+
+from async_runtime import iterate_async
+from example_store import get_example_store
+
+
+PAGE_SIZE = 100
+
+
+# Function to show a query result as a paginated dataframe
+def render_result(result, key):
+    with st.expander(f"Query result ({result.describe_rows()})"):
+        pages = max(1, math.ceil(result.row_count / PAGE_SIZE))
+        page = 1
+        if pages > 1:
+            page = st.number_input("Page", min_value=1, max_value=pages, value=1, key=f"result-page-{key}")
+        start = (page - 1) * PAGE_SIZE
+        st.dataframe(result.to_dataframe(start, start + PAGE_SIZE), use_container_width=True)
+
+
+# Function to show the per-stage timings, tokens and cache hits of a turn (see tracing.Trace.summary)
+def render_timings(summary: dict):
+    with st.expander(f"Timings ({summary['total_seconds']:.2f} s)"):
+        rows = []
+        for stage, values in summary["stages"].items():
+            rows.append({
+                "stage": stage,
+                "seconds": values.get("seconds"),
+                "prompt tokens": values.get("prompt_tokens"),
+                "completion tokens": values.get("completion_tokens"),
+                "cost ($)": values.get("cost"),
+                "rows": values.get("rows"),
+                "bytes": values.get("bytes"),
+            })
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        notes = [f"{cache} cache: {', '.join(results)}" for cache, results in summary["caches"].items()]
+        answer = summary["stages"].get("answer", {})
+        if "path" in answer:
+            notes.insert(0, f"answer: {answer['path']} path ({answer['kind']})")
+        if "reason" in summary["stages"].get("sql_strong", {}):
+            notes.insert(0, f"sql: strong model ({summary['stages']['sql_strong']['reason']})")
+        elif "sql_fast" in summary["stages"]:
+            notes.insert(0, "sql: fast model")
+        if notes:
+            st.caption(" · ".join(notes))
+
+
+# Function to show a turn's result: a chart for fast-path time series, nothing more for fast-path tables
+# (their rows are in the answer text), else paginated in an expander
+def render_output(key):
+    result = st.session_state.get("results", {}).get(key)
+    if result is None:
+        return
+    answer = st.session_state.get("answers", {}).get(key, {})
+    if answer.get("path") == "fast" and answer.get("kind") == "table":
+        return
+    if answer.get("path") == "fast" and answer.get("kind") == "timeseries":
+        st.line_chart(result.to_dataframe().set_index(result.columns[0]))
+    else:
+        render_result(result, key)
+
+
+# Function to offer the LLM answer of a deferred turn on demand; it replaces the message's short answer
+def render_explain(key):
+    explain = st.session_state.get("explainers", {}).get(key)
+    if explain is None:
+        return
+    if st.button("Explain with AI", key=f"explain-{key}"):
+        tokens = explain()
+        if hasattr(tokens, "__aiter__"):
+            tokens = iterate_async(tokens)
+        answer = st.write_stream(tokens)
+        st.session_state.chat_history[key] = AIMessage(content=answer)
+        st.session_state.answers[key].update(path="llm", on_demand=True)
+        del st.session_state.explainers[key]
+
+
+# Function to let the user approve a turn's SQL, adding it to the example store of the database
+def render_approval(key):
+    if key not in st.session_state.get("queries", {}) or "db" not in st.session_state:
+        return
+    question, query = st.session_state.queries[key]
+    if st.button("👍 Good query", key=f"approve-{key}", help="Use this question and SQL as an example"):
+        get_example_store(st.session_state.db).approve(question, query)
+        st.toast("Saved as an example for similar questions")
+
+
+# Function to show what was stored for a past AI message: its query result, timings and buttons
+def render_details(key):
+    render_output(key)
+    if key in st.session_state.get("timings", {}):
+        render_timings(st.session_state.timings[key])
+    render_explain(key)
+    render_approval(key)
+
+
+# Function to render the events of a turn inside the current chat message and return the answer.
+# The query result, answer path and timings are kept in st.session_state under key for later reruns.
+def render_stream(events, key, question: str = None) -> str:
+    with st.spinner("Writing the SQL query..."):
+        _, query = next(events)
+    st.code(query, language="sql")
+    with st.status("Running the query on your Database...") as status:
+        try:
+            kind, payload = next(events)
+            while kind == "repair":
+                error, query = payload
+                status.write(f"The query was rejected, trying a corrected one: {error}")
+                st.code(query, language="sql")
+                kind, payload = next(events)
+            result = payload
+        except Exception:
+            status.update(label="The query failed", state="error")
+            raise
+        status.update(label=f"Query executed ({result.describe_rows()})", state="complete", expanded=False)
+    st.session_state.setdefault("results", {})[key] = result
+    if question is not None:
+        st.session_state.setdefault("queries", {})[key] = (question, query)
+    _, answer = next(events)
+    st.session_state.setdefault("answers", {})[key] = {"path": answer["path"], "kind": answer["kind"]}
+    if "explain" in answer:
+        st.session_state.setdefault("explainers", {})[key] = answer["explain"]
+    summary = {}
+
+    def tokens():
+        for kind, payload in events:
+            if kind == "token":
+                yield payload
+            elif kind == "trace":
+                summary.update(payload)
+
+    text = st.write_stream(tokens())
+    render_output(key)
+    if summary:
+        st.session_state.setdefault("timings", {})[key] = summary
+        render_timings(summary)
+    render_explain(key)
+    render_approval(key)
+    return text
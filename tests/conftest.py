@@ -0,0 +1,13 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the caches the tests fill away from the real ones; must be set before importing them
+_cache_dir = tempfile.mkdtemp(prefix="sqlbot-tests-")
+atexit.register(shutil.rmtree, _cache_dir, ignore_errors=True)
+os.environ["SQLBOT_CACHE_DIR"] = _cache_dir
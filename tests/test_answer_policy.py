@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+
+from answer_policy import MAX_TABLE_ROWS, choose_path, classify, render_text
+from result_fetch import QueryResult
+
+
+def make_result(columns: list, rows: list, truncated: bool = False) -> QueryResult:
+    result = QueryResult(columns)
+    for row in rows:
+        result.append(row)
+    result.truncated = truncated
+    return result
+
+
+@pytest.mark.parametrize("columns, rows, kind", [
+    (["total"], [], "empty"),
+    (["total"], [(42,)], "scalar"),
+    (["state", "total"], [("Ohio", 42)], "record"),
+    (["year", "suicides"], [(2010, 5), (2011, 7), (2012, 6)], "timeseries"),
+    (["day", "total"], [(datetime.date(2024, 1, d), d) for d in range(1, 4)], "timeseries"),
+    (["state", "total"], [("Ohio", 42), ("Utah", 7)], "table"),
+    # A repeated x value is not a series
+    (["year", "suicides"], [(2010, 5), (2010, 7)], "table"),
+    (["state", "total"], [("Ohio", n) for n in range(MAX_TABLE_ROWS + 1)], "complex"),
+    (["a", "b", "c", "d", "e", "f", "g"], [tuple(range(7))] * 2, "complex"),
+])
+def test_classify(columns, rows, kind):
+    assert classify(make_result(columns, rows)) == kind
+
+
+def test_truncated_and_unknown_results_are_complex():
+    assert classify(make_result(["total"], [(1,)], truncated=True)) == "complex"
+    assert classify("[(1,)]") == "complex"
+
+
+@pytest.mark.parametrize("question, policy, path", [
+    ("How many crimes?", "auto", "fast"),
+    ("Why are there so many crimes?", "auto", "llm"),
+    ("How many crimes?", "llm", "llm"),
+    ("Why are there so many crimes?", "lazy", "fast"),
+])
+def test_choose_path_for_simple_results(question, policy, path):
+    assert choose_path(question, make_result(["total"], [(42,)]), policy) == (path, "scalar")
+
+
+@pytest.mark.parametrize("policy, path", [("auto", "llm"), ("lazy", "deferred"), ("llm", "llm")])
+def test_choose_path_for_complex_results(policy, path):
+    result = make_result(["state", "total"], [("Ohio", n) for n in range(MAX_TABLE_ROWS + 1)])
+    assert choose_path("List the totals", result, policy) == (path, "complex")
+
+
+def test_scalar_years_are_not_formatted_as_amounts():
+    assert render_text("scalar", make_result(["latest_year"], [(2012,)])) == "Latest year: **2012**"
+    assert render_text("scalar", make_result(["total_crimes"], [(12345,)])) == "Total crimes: **12,345**"
+
+
+def test_timeseries_text_names_the_extremes():
+    result = make_result(["year", "suicides"], [(2010, 1500), (2011, 7), (2012, 6)])
+    text = render_text("timeseries", result)
+    assert text.startswith("Suicides by year, 3 points from 2010 to 2012.")
+    assert "Highest: **1,500** (2010), lowest: **6** (2012)." in text
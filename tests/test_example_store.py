@@ -0,0 +1,70 @@
+import json
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from example_store import ExampleStore, get_example_store, load_examples
+
+
+SEED_QUESTION = "Count the total number of entries in the dataset."
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'crimes_2024.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE suicides_data (State TEXT, Year INTEGER)"))
+    return SQLDatabase(engine)
+
+
+@pytest.fixture
+def store(tmp_path):
+    seed_path = tmp_path / "seeds.jsonl"
+    seed_path.write_text(json.dumps({"question": "How many crimes?", "sql": "SELECT COUNT(*) FROM crimes"}) + "\n")
+    return ExampleStore(str(seed_path), str(tmp_path / "learned" / "crimes.jsonl"))
+
+
+def test_apps_name_their_seed_examples(db):
+    # The database is not named like any seed file
+    assert len(get_example_store(db)) == 0
+    store = get_example_store(db, "sucides")
+    assert store.search(SEED_QUESTION, k=1)[0]["source"] == "seed"
+    assert store.learned_path.endswith("crimes_2024.jsonl")
+    # Callers that don't know the seed set get the app's store
+    assert get_example_store(db) is store
+
+
+def test_executed_queries_never_replace_seeds_or_approved_examples(store):
+    assert not store.add("How many crimes?", "SELECT COUNT(id) FROM crimes")
+    assert store.approve("How many crimes?", "SELECT COUNT(id) FROM crimes")
+    assert not store.add("how many crimes", "SELECT 1")
+    best = store.search("How many crimes?", k=1)[0]
+    assert (best["sql"], best["source"]) == ("SELECT COUNT(id) FROM crimes", "approved")
+
+
+def test_approved_examples_rank_first_among_equally_relevant_ones(store):
+    store.add("crimes in Ohio", "SELECT * FROM crimes WHERE state = 'Ohio'")
+    store.approve("Ohio crimes", "SELECT * FROM crimes WHERE state = 'OH'")
+    assert [e["source"] for e in store.search("Ohio crimes", k=2)] == ["approved", "executed"]
+
+
+def test_learned_examples_are_written_once_and_compacted_on_load(store, tmp_path):
+    assert store.add("Crimes per state", "SELECT state, COUNT(*) FROM crimes GROUP BY state")
+    assert not store.add("crimes per state?", "SELECT state, COUNT(*) FROM crimes GROUP BY state")
+    store.add("Crimes per state", "SELECT state, COUNT(id) FROM crimes GROUP BY state")
+    store.add("Crimes in Utah", "SELECT COUNT(*) FROM crimes WHERE state = 'Utah'")
+    assert len(load_examples(store.learned_path)) == 3
+
+    reloaded = ExampleStore(store.seed_path, store.learned_path, max_learned=1)
+    assert [e["question"] for e in load_examples(store.learned_path)] == ["Crimes in Utah"]
+    assert len(reloaded) == 2
+
+
+def test_clear_learned_keeps_the_seeds(store):
+    store.approve("How many crimes?", "SELECT COUNT(id) FROM crimes")
+    store.add("Crimes in Utah", "SELECT COUNT(*) FROM crimes WHERE state = 'Utah'")
+    store.clear_learned()
+    assert len(store) == 1
+    assert store.search("How many crimes?", k=1)[0]["source"] == "seed"
+    assert load_examples(store.learned_path) == []
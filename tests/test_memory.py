@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import create_engine, text
+
+from benchmarks.fake_llm import ScriptedChatModel
+from memory import ConversationMemory
+from pipeline import SQLPipeline
+from text_index import estimate_tokens
+
+
+SQL_TEMPLATE = """Conversation History: {chat_history}
+    Schema: {schema}
+    {examples}
+    Question: {question}
+    SQL Query:"""
+ANSWER_TEMPLATE = """Conversation History: {chat_history}
+    Question: {question}
+    SQL Query: {query}
+    SQL Response: {response}"""
+SCRIPT = {
+    "How many crimes were reported?": "SELECT COUNT(*) AS total FROM crimes;",
+    "And in Ohio?": "SELECT COUNT(*) AS total FROM crimes WHERE state = 'Ohio';",
+}
+
+
+class RecordingModel(ScriptedChatModel):
+    def _reply(self, messages):
+        text = super()._reply(messages)
+        self.calls[-1]["prompt"] = "\n".join(str(m.content) for m in messages)
+        return text
+
+
+def conversation(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        history += [HumanMessage(content=f"question {i} " + "word " * 20),
+                    AIMessage(content=f"answer {i} " + "word " * 20)]
+    return history
+
+
+def test_history_stays_within_the_token_budget():
+    memory = ConversationMemory(recent_messages=6, token_budget=120)
+    memory.summary = "The user asked about crimes per state. " * 10
+    memory.summarized = 4
+    memory.record_sql("SELECT state, COUNT(*) FROM crimes GROUP BY state")
+    rendered = memory.render(conversation(8), "next question")
+    assert estimate_tokens(rendered) <= 120
+    assert "Previous SQL query: SELECT state, COUNT(*) FROM crimes GROUP BY state" in rendered
+    # The newest message is kept verbatim, the oldest ones are not
+    assert rendered.splitlines()[-1].startswith("AI: answer 7")
+    assert "question 0" not in rendered
+
+
+def test_a_long_query_is_cut_to_the_budget():
+    memory = ConversationMemory(token_budget=50)
+    memory.record_sql("SELECT " + ", ".join(f"column_{i}" for i in range(200)) + " FROM crimes")
+    rendered = memory.render(conversation(2), "next question")
+    assert estimate_tokens(rendered) <= 50
+    assert rendered.startswith("Previous SQL query: SELECT column_0") and rendered.endswith("...")
+
+
+def test_messages_not_summarized_yet_are_kept_while_they_fit():
+    memory = ConversationMemory(recent_messages=2, token_budget=1000)
+    rendered = memory.render(conversation(3), "next question")
+    assert [line.split(" ")[:2] for line in rendered.splitlines()] == [
+        ["Human:", "question"], ["AI:", "answer"]] * 3
+    # The current question, appended by the apps before asking, is not history
+    assert "next question" not in memory.render(conversation(1) + [HumanMessage(content="next question")],
+                                                "next question")
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'crimes.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE crimes (id INTEGER PRIMARY KEY, state TEXT)"))
+        conn.execute(text("INSERT INTO crimes (state) VALUES ('Ohio'), ('Utah')"))
+    return SQLDatabase(engine)
+
+
+def answer_prompts(llm) -> list:
+    return [call["prompt"] for call in llm.calls if call["kind"] == "answer"]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_answer_prompt_shows_the_query_of_the_turn_before(db, use_async):
+    llm = RecordingModel(script=SCRIPT, latency=0)
+    pipeline = SQLPipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE, llm=llm, use_cache=False)
+    pipeline.answer_policy = "llm"
+    memory, history = ConversationMemory(), []
+    for question in SCRIPT:
+        history.append(HumanMessage(content=question))
+        if use_async:
+            answer = asyncio.run(pipeline.ainvoke(question, history, memory))
+        else:
+            answer = pipeline.invoke(question, history, memory)
+        history.append(AIMessage(content=answer))
+
+    first, second = answer_prompts(llm)
+    assert "Previous SQL query" not in first
+    assert f"Previous SQL query: {SCRIPT['How many crimes were reported?']}" in second
+    assert f"Previous SQL query: {SCRIPT['And in Ohio?']}" not in second
+    # The SQL prompt of the follow-up builds on the first query
+    sql_prompts = [call["prompt"] for call in llm.calls if call["kind"] == "sql"]
+    assert f"Previous SQL query: {SCRIPT['How many crimes were reported?']}" in sql_prompts[1]
+    assert memory.last_sql == SCRIPT["And in Ohio?"]
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from sqlalchemy import create_engine, text
+
+import model_router
+from benchmarks.fake_llm import ScriptedChatModel
+from model_router import is_complex_question, is_complex_sql, with_model_tiers
+from tracing import metrics
+
+
+STRONG_SQL = "SELECT state, COUNT(*) FROM crimes GROUP BY state;"
+FAST_SCRIPT = {
+    "How many crimes are there?": "SELECT COUNT(*) FROM crimes;",
+    "Which states are listed?": "DROP TABLE states;",
+    "Crimes per region?": ("SELECT r.name, COUNT(*) FROM crimes c JOIN states s ON c.state = s.name"
+                           " JOIN regions r ON s.region = r.id GROUP BY r.name;"),
+    "Crimes per county?": "SELECT county, COUNT(*) FROM crimes GROUP BY county;",
+    "Pairs of crimes?": "SELECT COUNT(*) FROM crimes AS a JOIN crimes AS b ON a.id <> b.id;",
+}
+QUESTIONS = list(FAST_SCRIPT) + ["Compare crimes in Ohio versus Texas"]
+PROMPT = ChatPromptTemplate.from_template("Write SQL for the schema.\nQuestion: {question}\nSQL Query:")
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'router.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE regions (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("CREATE TABLE states (name TEXT PRIMARY KEY, region INTEGER)"))
+        conn.execute(text("CREATE TABLE crimes (id INTEGER PRIMARY KEY, state TEXT)"))
+        conn.execute(text("INSERT INTO crimes (state) VALUES (:state)"), [{"state": "Ohio"}] * 4000)
+    return SQLDatabase(engine)
+
+
+@pytest.fixture
+def models():
+    fast = ScriptedChatModel(script=FAST_SCRIPT, latency=0)
+    strong = ScriptedChatModel(script={question: STRONG_SQL for question in QUESTIONS}, latency=0)
+    return fast, strong
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    routes = []
+    monkeypatch.setattr(model_router, "record_route", lambda tier, reason: routes.append((tier, reason)))
+    return routes
+
+
+def _router(db, fast, strong):
+    return with_model_tiers(db, PROMPT | fast | StrOutputParser(), PROMPT | strong | StrOutputParser())
+
+
+@pytest.mark.parametrize("question, route", [
+    ("How many crimes are there?", ("fast", "validated")),
+    ("Which states are listed?", ("strong", "invalid_sql")),
+    ("Crimes per region?", ("strong", "complex_sql")),
+    ("Crimes per county?", ("strong", "explain_failed")),
+    ("Pairs of crimes?", ("strong", "too_expensive")),
+    ("Compare crimes in Ohio versus Texas", ("strong", "complex_question")),
+])
+def test_escalation_reasons(db, models, routes, question, route):
+    fast, strong = models
+    sql = _router(db, fast, strong).invoke({"question": question})
+    assert routes == [route]
+    assert sql == (FAST_SCRIPT[question] if route[0] == "fast" else STRONG_SQL)
+    # Complex questions never reach the fast model
+    assert len(fast.calls) == (route[1] != "complex_question")
+    assert len(strong.calls) == (route[0] == "strong")
+
+
+def test_async_routing_matches(db, models, routes):
+    fast, strong = models
+    router = _router(db, fast, strong)
+    for question in QUESTIONS:
+        asyncio.run(router.ainvoke({"question": question}))
+    assert [reason for _, reason in routes] == [
+        "validated", "invalid_sql", "complex_sql", "explain_failed", "too_expensive", "complex_question"]
+
+
+def test_routes_are_counted(db, models):
+    fast, strong = models
+    key = ("sqlbot_sql_route_total", (("reason", "invalid_sql"), ("tier", "strong")))
+    before = metrics._counters[key]
+    _router(db, fast, strong).invoke({"question": "Which states are listed?"})
+    assert metrics._counters[key] == before + 1
+
+
+def test_complexity_checks():
+    assert is_complex_question("What is the year over year growth?")
+    assert not is_complex_question("How many crimes were there in 2010?")
+    assert is_complex_sql("SELECT * FROM a WHERE id IN (SELECT id FROM b)")
+    assert is_complex_sql("SELECT id FROM a UNION SELECT id FROM b")
+    assert is_complex_sql("SELECT RANK() OVER (ORDER BY n) FROM a")
+    # Keywords inside string literals don't count
+    assert not is_complex_sql("SELECT * FROM a JOIN b ON a.id = b.id WHERE note = 'join (select union)'")
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+import result_cache as result_cache_module
+from result_cache import ResultCache, canonicalize_sql, referenced_tables
+
+
+class FakeCatalog:
+    """Reports the table data versions a test sets, like MySQL's UPDATE_TIME."""
+
+    def __init__(self):
+        self.data = {"crimes": "2024-01-01 10:00:00", "states": "2024-01-01 10:00:00"}
+
+    def versions(self, db):
+        return {table: (version, "ddl") for table, version in self.data.items()}
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    catalog = FakeCatalog()
+    monkeypatch.setattr(result_cache_module, "catalog", catalog)
+    return catalog
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SQLDatabase(create_engine(f"sqlite:///{tmp_path / 'crimes.sqlite3'}"))
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, sql):
+        self.calls += 1
+        return f"result {self.calls}"
+
+
+SQL = "SELECT state, COUNT(*) FROM crimes GROUP BY state"
+
+
+def test_result_is_dropped_when_a_table_it_reads_changes(catalog, db):
+    cache, execute = ResultCache(), Counter()
+    assert cache.run(db, SQL, execute) == "result 1"
+    assert cache.run(db, SQL.lower() + ";", execute) == "result 1"
+    # Another table changing does not matter
+    catalog.data["states"] = "2024-01-01 11:00:00"
+    assert cache.run(db, SQL, execute) == "result 1"
+    catalog.data["crimes"] = "2024-01-01 11:00:00"
+    assert cache.run(db, SQL, execute) == "result 2"
+    assert cache.run(db, SQL, execute) == "result 2"
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+
+def test_async_lookups_see_data_changes_too(catalog, db):
+    cache, counter = ResultCache(), Counter()
+
+    async def execute(sql):
+        return counter(sql)
+
+    async def turns():
+        first = await cache.arun(db, SQL, execute)
+        catalog.data["crimes"] = "2024-01-02 00:00:00"
+        return first, await cache.arun(db, SQL, execute), await cache.arun(db, SQL, execute)
+
+    assert asyncio.run(turns()) == ("result 1", "result 2", "result 2")
+
+
+def test_results_expire_and_can_be_invalidated_by_hand(catalog, db, monkeypatch):
+    cache, execute = ResultCache(max_age=60), Counter()
+    cache.run(db, SQL, execute)
+    cache.invalidate(db, table="states")
+    assert cache.run(db, SQL, execute) == "result 1"
+    cache.invalidate(db, table="crimes")
+    assert cache.run(db, SQL, execute) == "result 2"
+    now = result_cache_module.time.monotonic()
+    monkeypatch.setattr(result_cache_module.time, "monotonic", lambda: now + 61)
+    assert cache.run(db, SQL, execute) == "result 3"
+
+
+def test_volatile_queries_are_not_cached(catalog, db):
+    cache, execute = ResultCache(), Counter()
+    sql = "SELECT COUNT(*) FROM crimes WHERE reported_at > NOW() - INTERVAL 1 DAY"
+    cache.run(db, sql, execute)
+    assert cache.run(db, sql, execute) == "result 2"
+    assert cache.stats()["entries"] == 0
+
+
+def test_canonical_sql_keeps_literals():
+    sql = "SELECT * FROM crimes WHERE state = 'Ohio'"
+    assert canonicalize_sql("select *  FROM Crimes -- all\n WHERE state='Ohio' ;") == canonicalize_sql(sql)
+    assert canonicalize_sql(sql) != canonicalize_sql(sql.replace("Ohio", "OHIO"))
+    assert referenced_tables("SELECT * FROM crimes c JOIN `db`.`states` s ON c.state = s.name") == {"crimes", "states"}
@@ -0,0 +1,189 @@
+import random
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import rollups as rollups_module
+from connection_manager import connect_with_timeout, get_database
+from rollups import Rollups, parse_aggregate, rewrite, same_rows
+from sql_guard import QueryTooExpensiveError
+
+
+STATES = ["Ohio", "Texas", "Utah", "Iowa"]
+HOT_SQL = "SELECT Year, Gender, COUNT(*), SUM(victims), AVG(victims) FROM crimes GROUP BY Year, Gender"
+
+
+def _database(path, gender_collation=""):
+    engine = create_engine(f"sqlite:///{path}")
+    rng = random.Random(7)
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE crimes (id INTEGER PRIMARY KEY, Year INTEGER, Gender TEXT {gender_collation},"
+            " State TEXT, victims INTEGER)"
+        ))
+        conn.execute(
+            text("INSERT INTO crimes (Year, Gender, State, victims) VALUES (:year, :gender, :state, :victims)"),
+            [{"year": rng.randint(2005, 2015), "gender": rng.choice(["male", "female", None]),
+              "state": rng.choice(STATES), "victims": rng.choice([rng.randint(1, 9), None])} for _ in range(3000)],
+        )
+    return SQLDatabase(engine)
+
+
+@pytest.fixture
+def rollups(tmp_path):
+    db = _database(tmp_path / "base.sqlite3")
+    rollups = Rollups(db, str(tmp_path / "rollups.sqlite3"), hot_queries=1)
+    rollups.record(HOT_SQL)
+    rollups.record("SELECT State, COUNT(*) FROM crimes WHERE Year = 2010 GROUP BY State")
+    assert list(rollups.maintain().values()) == ["ready"]
+    return rollups
+
+
+def _base_rows(rollups, sql):
+    with rollups.db._engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(sql))]
+
+
+def test_parse_aggregate():
+    shape = parse_aggregate("SELECT `Year`, COUNT(*) AS n FROM crimes WHERE Gender = 'male' AND Year BETWEEN 2008 AND 2010"
+                            " GROUP BY `Year` ORDER BY n DESC LIMIT 3;")
+    assert shape["source"] == "crimes"
+    assert shape["group"] == ["year"]
+    assert shape["where"] == [("gender", "=", "'male'"), ("year", "BETWEEN", "2008 AND 2010")]
+    assert set(shape["dimensions"]) == {"year", "gender"}
+    assert shape["order"] == [(1, "DESC")] and shape["limit"] == 3
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT Year FROM crimes",
+    "SELECT Year, COUNT(*) FROM crimes GROUP BY Year HAVING COUNT(*) > 1",
+    "SELECT COUNT(*) FROM crimes WHERE victims + 1 > 2",
+    "SELECT COUNT(*) FROM (SELECT * FROM crimes) AS c",
+])
+def test_parse_aggregate_rejects_other_shapes(sql):
+    assert parse_aggregate(sql) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(*) FROM crimes",
+    "SELECT Year, AVG(victims) AS average FROM crimes GROUP BY Year",
+    "SELECT Gender, SUM(victims) FROM crimes WHERE Year = '2010' GROUP BY Gender",
+    "SELECT COUNT(*) FROM crimes WHERE Year = '2010' AND Gender = 'male'",
+    "SELECT State, COUNT(*) FROM crimes WHERE Year IN (2008, '2009') AND Gender <> 'female' GROUP BY State",
+    "SELECT COUNT(DISTINCT Gender) FROM crimes WHERE Year BETWEEN 2006 AND 2009",
+    "SELECT Year, COUNT(*) AS n FROM crimes WHERE Gender IS NULL GROUP BY Year ORDER BY Year DESC LIMIT 3",
+    "SELECT COUNT(*) FROM crimes WHERE Year >= 2012.5 AND State NOT IN ('Ohio')",
+])
+def test_rollup_answers_match_base_tables(rollups, sql):
+    result = rollups.run(sql)
+    assert result is not None, sql
+    assert same_rows(result.rows(), _base_rows(rollups, sql))
+    assert result.rows()
+
+
+@pytest.mark.parametrize("sql", [
+    # Literals of another type than the column, compared differently by SQLite and MySQL
+    "SELECT COUNT(*) FROM crimes WHERE Year = '2010abc'",
+    "SELECT COUNT(*) FROM crimes WHERE State = 5",
+    "SELECT COUNT(*) FROM crimes WHERE Gender = \"male\"",
+    # String ordering and escapes follow the database's collation
+    "SELECT COUNT(*) FROM crimes WHERE Gender < 'm'",
+    "SELECT COUNT(*) FROM crimes WHERE Gender = 'male '",
+    "SELECT COUNT(*) FROM crimes WHERE Gender = 'ma\\\\le'",
+    # A binary collation is case-sensitive, SQLite's LIKE is not
+    "SELECT COUNT(*) FROM crimes WHERE Gender LIKE 'm%'",
+    "SELECT Gender, COUNT(*) FROM crimes GROUP BY Gender ORDER BY Gender LIMIT 1",
+    # Not in the rollup
+    "SELECT COUNT(*) FROM crimes WHERE victims = 3",
+])
+def test_rollup_does_not_rewrite_unsafe_filters(rollups, sql):
+    assert rollups.run(sql) is None
+
+
+def test_case_insensitive_columns_compare_without_case(tmp_path):
+    db = _database(tmp_path / "base.sqlite3", gender_collation="COLLATE NOCASE")
+    rollups = Rollups(db, str(tmp_path / "rollups.sqlite3"), hot_queries=1)
+    rollups.record(HOT_SQL)
+    rollups.maintain()
+    rollup = rollups._rollups["crimes"]
+    assert rollup["kinds"] == {"gender": "text", "year": "integer"}
+    # What a MySQL _ci collation gives; SQLite bases report binary
+    rollup["collations"]["gender"] = "nocase"
+    for sql in ["SELECT COUNT(*) FROM crimes WHERE Gender = 'MALE'",
+                "SELECT Year, COUNT(*) FROM crimes WHERE Gender IN ('Male', 'FEMALE') GROUP BY Year",
+                "SELECT COUNT(*) FROM crimes WHERE Gender LIKE 'M%'"]:
+        shape = parse_aggregate(sql)
+        assert "COLLATE NOCASE" in rewrite(shape, rollup) or "LIKE" in sql
+        assert same_rows(rollups.run(sql).rows(), _base_rows(rollups, sql))
+    assert rollups.run("SELECT COUNT(*) FROM crimes WHERE Gender = 'mâle'") is None
+
+
+def test_rollup_with_wrong_answers_is_dropped(rollups, monkeypatch):
+    rollup = rollups._rollups["crimes"]
+    monkeypatch.setattr(rollups_module, "rewrite", lambda shape, rollup, table=None, core=False: (
+        f"SELECT d0, d1, COUNT(*), SUM(m1), AVG(m1) FROM {table} GROUP BY d0, d1"))
+    assert rollups.build(dict(rollup, samples=[HOT_SQL])) == "wrong_answers"
+    assert rollups.run(HOT_SQL) is None
+
+
+def test_rollups_expire_after_max_age(rollups):
+    assert rollups.run(HOT_SQL) is not None
+    rollups.max_age = 0
+    assert rollups.run(HOT_SQL) is None
+
+
+def test_failed_build_waits_before_retrying(rollups, monkeypatch):
+    calls = []
+
+    def failing_build(plan, verify=True):
+        calls.append(plan["source"])
+        raise RuntimeError("Query execution was interrupted")
+
+    rollups.max_age = 0
+    rollups.record(HOT_SQL)
+    monkeypatch.setattr(rollups, "build", failing_build)
+    assert rollups.maintain() == {"crimes": "failed"}
+    assert rollups._rollups["crimes"]["status"] == "failed"
+    rollups.record(HOT_SQL)
+    assert rollups.maintain() == {}
+    assert calls == ["crimes"]
+
+
+def test_stale_rollup_is_rebuilt_only_when_asked_for(rollups):
+    rollups.max_age = 0
+    assert rollups.maintain() == {}
+    assert rollups.run(HOT_SQL) is None
+    rollups.record(HOT_SQL)
+    assert rollups.maintain() == {"crimes": "ready"}
+
+
+def test_expensive_build_is_not_run(rollups, monkeypatch):
+    def expensive(db, sql):
+        assert sql.endswith(f"LIMIT {rollups.max_rows + 1}")
+        raise QueryTooExpensiveError("too many rows")
+
+    monkeypatch.setattr(rollups_module, "check_cost", expensive)
+    assert rollups.build(dict(rollups._rollups["crimes"], samples=[HOT_SQL])) == "too_expensive"
+    assert rollups.run(HOT_SQL) is None
+
+
+def test_too_large_build_is_dropped(rollups):
+    rollups.max_rows = 5
+    assert rollups.build(dict(rollups._rollups["crimes"], samples=[HOT_SQL])) == "too_large"
+    assert rollups._rollups["crimes"]["rows"] == 6
+
+
+def test_build_connection_has_its_own_timeout(tmp_path):
+    db = get_database(f"sqlite:///{tmp_path / 'timeout.sqlite3'}", statement_timeout=0.05)
+    slow = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 1000000) SELECT COUNT(*) FROM c"
+    with connect_with_timeout(db, 60) as conn:
+        assert conn.execute(text(slow)).scalar() == 1000000
+    with pytest.raises(OperationalError):
+        with connect_with_timeout(db, 0.05) as conn:
+            conn.execute(text(slow)).scalar()
+    # The pool gets the connection back with the usual timeout
+    with pytest.raises(OperationalError):
+        with db._engine.connect() as conn:
+            conn.execute(text(slow)).scalar()
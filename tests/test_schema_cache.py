@@ -0,0 +1,27 @@
+from sqlalchemy import create_engine, text
+
+from connection_manager import get_database
+from schema_cache import SchemaCatalog
+
+
+def test_tables_created_after_connecting_are_seen(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'schema.sqlite3'}"
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE crimes (id INTEGER PRIMARY KEY, state TEXT)"))
+    db = get_database(uri)
+    catalog = SchemaCatalog(check_interval=0)
+    assert list(catalog.get_table_infos(db)) == ["crimes"]
+    fingerprint = catalog.fingerprint(db)
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE victims (id INTEGER PRIMARY KEY, age INTEGER)"))
+    # Connecting again returns the same shared database, which must still see the new table
+    assert get_database(uri) is db
+    assert sorted(db.get_usable_table_names()) == ["crimes", "victims"]
+    assert "CREATE TABLE victims" in catalog.get_table_info(db)
+    assert catalog.fingerprint(db) != fingerprint
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE crimes"))
+    assert list(catalog.get_table_infos(db)) == ["victims"]
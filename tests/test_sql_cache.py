@@ -0,0 +1,104 @@
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from benchmarks.fake_llm import ScriptedChatModel
+from pipeline import SQLPipeline
+from result_cache import result_cache
+from sql_cache import SQLCache
+
+
+SQL_TEMPLATE = """Schema: {schema}
+    {examples}
+    Conversation History: {chat_history}
+    Question: {question}
+    SQL Query:"""
+ANSWER_TEMPLATE = """Question: {question}
+    SQL Query: {query}
+    SQL Response: {response}"""
+QUESTION = "How many crimes were reported in Ohio?"
+BROKEN_SQL = "SELECT COUNT(*) FROM crimes WHERE region = 'Ohio';"
+REPAIRED_SQL = "SELECT COUNT(*) FROM crimes WHERE state = 'Ohio';"
+
+
+class RepairingModel(ScriptedChatModel):
+    """Writes broken SQL for the question and the right query when asked for a correction."""
+
+    def _reply(self, messages):
+        if "Corrected SQL Query:" in "\n".join(str(m.content) for m in messages):
+            self.calls.append({"kind": "repair"})
+            return REPAIRED_SQL
+        return super()._reply(messages)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLCache(str(tmp_path / "sql_cache.sqlite3"))
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'crimes.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE crimes (id INTEGER PRIMARY KEY, state TEXT)"))
+        conn.execute(text("INSERT INTO crimes (state) VALUES ('Ohio'), ('Ohio'), ('Utah')"))
+    return SQLDatabase(engine)
+
+
+def test_exact_match_ignores_case_and_punctuation(cache):
+    cache.put("fp", "How many crimes?", "SELECT COUNT(*) FROM crimes;")
+    assert cache.get("fp", "  how many CRIMES ") == "SELECT COUNT(*) FROM crimes;"
+    assert cache.get("other-fp", "How many crimes?") is None
+
+
+def test_near_duplicates_are_off_by_default(cache):
+    cache.put("fp", "number of crimes for male victims", "SELECT 1")
+    assert cache.near_duplicate_threshold == 0
+    assert cache.get("fp", "crimes for male victims number") is None
+
+
+def test_near_duplicates_need_the_same_content_words(cache):
+    cache.near_duplicate_threshold = 0.5
+    cache.put("fp", "number of crimes for male victims", "SELECT 1")
+    assert cache.get("fp", "number of crimes excluding male victims") is None
+    assert cache.get("fp", "crimes for male victims, number of") == "SELECT 1"
+
+
+def _sql(pipeline, question=QUESTION):
+    return [payload for kind, payload in pipeline.stream(question, []) if kind == "sql"][0]
+
+
+def test_repaired_sql_is_cached_in_place_of_the_broken_query(db):
+    llm = RepairingModel(script={QUESTION: BROKEN_SQL}, latency=0)
+    pipeline = SQLPipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE, llm=llm)
+    events = list(pipeline.stream(QUESTION, []))
+    assert ("repair" in [kind for kind, _ in events]) and len(llm.calls) == 2
+    assert _sql(pipeline) == REPAIRED_SQL
+    # Served from the cache: neither the broken query nor the repair is paid for again
+    assert len(llm.calls) == 2
+
+
+def test_prompts_and_models_do_not_share_cached_sql(db):
+    first = ScriptedChatModel(script={QUESTION: REPAIRED_SQL}, latency=0)
+    assert _sql(SQLPipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE, llm=first)) == REPAIRED_SQL
+    edited = ScriptedChatModel(script={QUESTION: "SELECT COUNT(id) FROM crimes WHERE state = 'Ohio';"}, latency=0)
+    assert _sql(SQLPipeline(db, SQL_TEMPLATE + "\n    Use COUNT(id).", ANSWER_TEMPLATE, llm=edited)).startswith(
+        "SELECT COUNT(id)")
+    assert len(edited.calls) == 1
+    # The same prompt and model do share it
+    again = ScriptedChatModel(script={}, latency=0)
+    assert _sql(SQLPipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE, llm=again)) == REPAIRED_SQL
+    assert again.calls == []
+
+
+def test_pipeline_without_cache_writes_and_runs_fresh_sql(db):
+    cached = ScriptedChatModel(script={QUESTION: REPAIRED_SQL}, latency=0)
+    _sql(SQLPipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE, llm=cached))
+    # The same prompt and model, so the SQL and the result are cached for it
+    llm = ScriptedChatModel(script={QUESTION: REPAIRED_SQL}, latency=0)
+    pipeline = SQLPipeline(db, SQL_TEMPLATE, ANSWER_TEMPLATE, llm=llm, use_cache=False)
+    hits = result_cache.stats()["hits"]
+    for _ in range(2):
+        assert _sql(pipeline) == REPAIRED_SQL
+    assert len(llm.calls) == 2
+    assert result_cache.stats()["hits"] == hits
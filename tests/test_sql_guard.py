@@ -0,0 +1,64 @@
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from sql_guard import DEFAULT_LIMIT, QueryTooExpensiveError, UnsafeQueryError, check_cost, prepare_sql
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM crimes", f"SELECT * FROM crimes\nLIMIT {DEFAULT_LIMIT}"),
+    ("```sql\nSELECT COUNT(*) FROM crimes;\n```", f"SELECT COUNT(*) FROM crimes\nLIMIT {DEFAULT_LIMIT}"),
+    ("SELECT * FROM crimes LIMIT 5;", "SELECT * FROM crimes LIMIT 5"),
+    ("SELECT * FROM crimes -- all of them", f"SELECT * FROM crimes -- all of them\nLIMIT {DEFAULT_LIMIT}"),
+    # A LIMIT inside a subquery doesn't bound the outer query
+    ("SELECT * FROM (SELECT * FROM crimes LIMIT 3) AS c", f"SELECT * FROM (SELECT * FROM crimes LIMIT 3) AS c\nLIMIT {DEFAULT_LIMIT}"),
+    ("WITH t AS (SELECT 1 AS x) SELECT x FROM t", f"WITH t AS (SELECT 1 AS x) SELECT x FROM t\nLIMIT {DEFAULT_LIMIT}"),
+    # Keywords in literals and comments are not SQL
+    ("SELECT 'drop table; delete' AS note", f"SELECT 'drop table; delete' AS note\nLIMIT {DEFAULT_LIMIT}"),
+    ("SELECT `update` FROM t /* insert */", f"SELECT `update` FROM t /* insert */\nLIMIT {DEFAULT_LIMIT}"),
+    ("SHOW TABLES", "SHOW TABLES"),
+    ("DESCRIBE crimes", "DESCRIBE crimes"),
+])
+def test_prepare_sql_accepts_read_only_queries(sql, expected):
+    assert prepare_sql(sql) == expected
+
+
+def test_prepare_sql_without_limit():
+    assert prepare_sql("SELECT * FROM crimes;", limit=None) == "SELECT * FROM crimes"
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "```sql\n```",
+    "DROP TABLE crimes",
+    "DELETE FROM crimes",
+    "SELECT 1; DROP TABLE crimes",
+    "SELECT * INTO backup FROM crimes",
+    "SELECT * FROM crimes FOR UPDATE",
+    "WITH t AS (DELETE FROM crimes RETURNING *) SELECT * FROM t",
+    "SELECT SLEEP(10)",
+    "SELECT BENCHMARK(1000000, MD5('x'))",
+    "SELECT LOAD_FILE('/etc/passwd')",
+    "EXPLAIN ANALYZE SELECT * FROM crimes",
+])
+def test_prepare_sql_rejects_unsafe_statements(sql):
+    with pytest.raises(UnsafeQueryError):
+        prepare_sql(sql)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'guard.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE crimes (id INTEGER PRIMARY KEY, state TEXT)"))
+        conn.execute(text("INSERT INTO crimes (state) VALUES (:state)"), [{"state": f"s{i}"} for i in range(1000)])
+    return SQLDatabase(engine)
+
+
+def test_check_cost(db):
+    assert check_cost(db, "SELECT * FROM crimes WHERE id = 5", max_examined_rows=10) == "SELECT * FROM crimes WHERE id = 5"
+    # An equi-join reads each table once, through an automatic index
+    assert check_cost(db, "SELECT * FROM crimes a, crimes b WHERE a.state = b.state", max_examined_rows=10_000)
+    # SQLite's plan names aliased tables by their alias
+    with pytest.raises(QueryTooExpensiveError):
+        check_cost(db, "SELECT * FROM crimes AS a JOIN crimes AS b ON a.id <> b.id", max_examined_rows=10_000)
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from web_ingest import HTTPCache, crawl, fetch
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str = "", headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body.encode())))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_GET(self):
+        port = self.server.server_address[1]
+        SiteHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/":
+            self._send(200, (
+                "<html><head><title>Home</title></head><body><p>Crime statistics by state.</p>"
+                '<a href="/a">A</a> <a href="/b#top">B</a> <a href="/slow">slow</a>'
+                f'<a href="http://localhost:{port}/elsewhere">other host</a></body></html>'
+            ), {"Content-Type": "text/html"})
+        elif self.path == "/a":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self._send(304, headers={"ETag": '"v1"'})
+            else:
+                self._send(200, "<p>Victims by year.</p>", {"Content-Type": "text/html", "ETag": '"v1"'})
+        elif self.path == "/b":
+            self._send(200, "<p>Arrests by city.</p>", {"Content-Type": "text/html"})
+        elif self.path == "/slow":
+            time.sleep(1)
+            self._send(200, "<p>Too late.</p>", {"Content-Type": "text/html"})
+        else:
+            self._send(404)
+
+
+@pytest.fixture
+def site():
+    SiteHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _crawl(url, cache, **crawl_args):
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return await crawl(url, cache=cache, client=client, timeout=0.3, **crawl_args)
+
+    return asyncio.run(run())
+
+
+def test_crawl_same_host_with_timeout(site, tmp_path):
+    pages = _crawl(site + "/", HTTPCache(str(tmp_path)))
+    # /slow timed out and the localhost link is another host
+    assert sorted(page["url"] for page in pages) == [site + "/", site + "/a", site + "/b"]
+    assert "/elsewhere" not in [path for path, _ in SiteHandler.requests]
+    assert pages[0]["title"] == "Home" and pages[0]["blocks"] == ["Crime statistics by state."]
+
+
+def test_crawl_respects_max_pages(site, tmp_path):
+    pages = _crawl(site + "/", HTTPCache(str(tmp_path)), max_pages=2)
+    assert len(pages) == 2
+
+
+def test_etag_revalidation_reuses_cached_page(site, tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    _crawl(site + "/", cache)
+    fetched_at = cache.load(site + "/a")["fetched_at"]
+    SiteHandler.requests = []
+    pages = _crawl(site + "/", cache)
+    assert ("/a", '"v1"') in SiteHandler.requests
+    assert {page["url"]: page["blocks"] for page in pages}[site + "/a"] == ["Victims by year."]
+    assert cache.load(site + "/a")["fetched_at"] == fetched_at
+
+
+def test_fetch_timeout_returns_stale_copy(site, tmp_path):
+    cache = HTTPCache(str(tmp_path))
+
+    async def run(timeout):
+        async with httpx.AsyncClient() as client:
+            return await fetch(client, cache, site + "/slow", timeout=timeout)
+
+    assert asyncio.run(run(0.2)) is None
+    assert asyncio.run(run(5))["text"] == "<p>Too late.</p>"
+    assert asyncio.run(run(0.2))["text"] == "<p>Too late.</p>"
@@ -0,0 +1,88 @@
+"""Small, dependency-free text helpers: tokenizing, token estimates and a BM25 index.
+
+Everything here runs locally so that schema pruning and the caches built on top of it
+never need a network round-trip.
+"""
+import math
+import re
+from collections import Counter
+
+
+_WORD_RE = re.compile(r"[A-Za-z]+|\d+")
+_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "each", "for", "from",
+    "give", "how", "i", "in", "is", "it", "list", "me", "many", "much", "of", "on", "or", "please",
+    "show", "tell", "that", "the", "their", "there", "these", "this", "those", "to", "was", "we",
+    "were", "what", "when", "where", "which", "who", "with", "you",
+}
+
+
+# Function to stem a word just enough that "states" matches a column called "State"
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+# Function to split text and SQL identifiers (snake_case, camelCase) into search terms
+def tokenize(text: str) -> list:
+    terms = []
+    for word in _WORD_RE.findall(_CAMEL_RE.sub(" ", text or "")):
+        word = word.lower()
+        if word not in _STOPWORDS:
+            terms.append(_stem(word))
+    return terms
+
+
+# Function to estimate the number of LLM tokens in a piece of text (~4 characters per token)
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + 3) // 4
+
+
+# Function to compute the cosine similarity of two texts over their term counts
+def similarity(a: str, b: str) -> float:
+    left, right = Counter(tokenize(a)), Counter(tokenize(b))
+    if not left or not right:
+        return 0.0
+    dot = sum(count * right[term] for term, count in left.items())
+    norm = math.sqrt(sum(c * c for c in left.values())) * math.sqrt(sum(c * c for c in right.values()))
+    return dot / norm
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents."""
+
+    def __init__(self, documents: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs = [Counter(tokenize(doc)) for doc in documents]
+        self._lengths = [sum(doc.values()) for doc in self._docs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._docs else 0.0
+        doc_freq = Counter(term for doc in self._docs for term in doc)
+        n = len(self._docs)
+        self._idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def scores(self, query: str) -> list:
+        terms = tokenize(query)
+        results = []
+        for doc, length in zip(self._docs, self._lengths):
+            score = 0.0
+            for term in terms:
+                freq = doc.get(term)
+                if not freq:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / (self._avg_length or 1))
+                score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            results.append(score)
+        return results
+
+    def search(self, query: str, k: int = 5) -> list:
+        """Return up to ``k`` ``(document_index, score)`` pairs with a positive score."""
+        ranked = sorted(enumerate(self.scores(query)), key=lambda item: item[1], reverse=True)
+        return [(i, score) for i, score in ranked[:k] if score > 0]
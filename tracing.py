@@ -0,0 +1,292 @@
+"""Per-turn tracing and process-wide metrics.
+
+A ``Trace`` collects one span per pipeline stage (schema fetch, SQL generation, query
+execution, answer synthesis) with its wall time, LLM token counts and estimated cost (from
+``PRICES``), rows and result bytes, plus the cache hits and misses seen along the way.
+Finished traces are logged as one JSON line on the ``sqlbot.trace`` logger, and every span
+also feeds the Prometheus-style metrics served by ``start_metrics_server()`` on ``/metrics``.
+
+The caches report to this module, so it imports none of the app's modules at load time;
+the cache and pool gauges import them when ``/metrics`` is scraped.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+METRICS_PORT = int(os.getenv("SQLBOT_METRICS_PORT", "9108"))
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Dollars per million prompt and completion tokens; a model name matches its longest prefix here
+PRICES = {
+    "gpt-4-0125-preview": (10.0, 30.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+
+logger = logging.getLogger("sqlbot.trace")
+_current = contextvars.ContextVar("sqlbot_trace", default=None)
+
+
+class Metrics:
+    """A minimal in-process registry of counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self._histograms.get(key, ([0] * len(BUCKETS), 0.0, 0))
+            buckets = [n + (value <= bound) for n, bound in zip(buckets, BUCKETS)]
+            self._histograms[key] = (buckets, total + value, count + 1)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        def fmt(labels) -> str:
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}{fmt(labels)} {value:g}")
+            for (name, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                for bound, n in zip(BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{fmt(labels + (('le', f'{bound:g}'),))} {n}")
+                lines.append(f"{name}_bucket{fmt(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{fmt(labels)} {total:g}")
+                lines.append(f"{name}_count{fmt(labels)} {count}")
+        lines.extend(_gauges())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Function to collect gauges from the caches and connection pools at scrape time
+def _gauges() -> list:
+    # Imported here because those modules report to this one
+    from connection_manager import pool_stats
+    from result_cache import result_cache
+    from schema_cache import catalog
+    from sql_cache import sql_cache
+
+    lines = []
+    for name, stats in [("schema", catalog.stats()), ("sql", sql_cache.stats()), ("result", result_cache.stats())]:
+        lines.append(f'sqlbot_cache_hit_rate{{cache="{name}"}} {stats["hit_rate"]:g}')
+    result_stats = result_cache.stats()
+    lines.append(f"sqlbot_result_cache_bytes {result_stats['bytes']}")
+    lines.append(f"sqlbot_result_cache_bytes_saved {result_stats['bytes_saved']}")
+    lines.append(f"sqlbot_result_cache_db_seconds_saved {result_stats['db_time_saved']:g}")
+    for pool in pool_stats():
+        if "checked_out" in pool:
+            lines.append(f'sqlbot_pool_checked_out{{database="{pool["database"]}"}} {pool["checked_out"]}')
+            lines.append(f'sqlbot_pool_utilization{{database="{pool["database"]}"}} {pool["utilization"]:g}')
+    return lines
+
+
+class Trace:
+    def __init__(self, question: str = ""):
+        self.question = question
+        self.spans = []
+        self.caches = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def span(self, stage: str, **attributes) -> "_Span":
+        """Time a stage: ``with trace.span("query") as attrs: attrs["rows"] = ...``."""
+        return _Span(self, stage, attributes)
+
+    def add(self, stage: str, **values):
+        """Add numbers (e.g. token counts) to the most recent span of a stage."""
+        with self._lock:
+            for span in reversed(self.spans):
+                if span["stage"] == stage:
+                    break
+            else:
+                span = {"stage": stage, "seconds": 0.0}
+                self.spans.append(span)
+            for key, value in values.items():
+                span[key] = span.get(key, 0) + value
+
+    def record_cache(self, cache: str, hit: bool):
+        with self._lock:
+            self.caches.append({"cache": cache, "hit": hit})
+
+    def summary(self) -> dict:
+        """Per-stage totals for display: seconds, tokens, rows, bytes and cache results."""
+        stages = {}
+        with self._lock:
+            for span in self.spans:
+                stage = stages.setdefault(span["stage"], {})
+                for key, value in span.items():
+                    if key == "stage":
+                        continue
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        stage[key] = round(stage.get(key, 0) + value, 4)
+                    else:
+                        stage[key] = value
+            caches = {}
+            for event in self.caches:
+                caches.setdefault(event["cache"], []).append("hit" if event["hit"] else "miss")
+        return {"total_seconds": round(time.perf_counter() - self.started, 4), "stages": stages, "caches": caches}
+
+    def finish(self, status: str = "ok") -> dict:
+        summary = self.summary()
+        metrics.inc("sqlbot_turns_total", status=status)
+        metrics.observe("sqlbot_turn_seconds", summary["total_seconds"])
+        logger.info(json.dumps({"event": "turn", "status": status, "question": self.question, **summary},
+                               default=str))
+        return summary
+
+
+class _Span:
+    def __init__(self, trace: Trace, stage: str, attributes: dict):
+        self.trace = trace
+        self.stage = stage
+        self.attributes = attributes
+
+    def __enter__(self) -> dict:
+        self._token = _current.set(self.trace)
+        self._started = time.perf_counter()
+        return self.attributes
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        span = {"stage": self.stage, "seconds": seconds, **self.attributes}
+        if exc_type is not None:
+            span["error"] = exc_type.__name__
+        with self.trace._lock:
+            self.trace.spans.append(span)
+        metrics.observe("sqlbot_stage_seconds", seconds, stage=self.stage)
+        for key in ("rows", "bytes"):
+            if isinstance(self.attributes.get(key), (int, float)):
+                metrics.inc(f"sqlbot_result_{key}_total", self.attributes[key])
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Exited from another context, e.g. a streamed stage resumed in a new task
+            _current.set(None)
+        return False
+
+
+# Function to estimate the dollar cost of an LLM call (0 for models without a known price)
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    names = [name for name in PRICES if model.startswith(name)]
+    if not names:
+        return 0.0
+    prompt_price, completion_price = PRICES[max(names, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+# Function for the caches to report a hit or miss to the metrics and to the trace of the current turn
+def record_cache(cache: str, hit: bool):
+    metrics.inc("sqlbot_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+    trace = _current.get()
+    if trace is not None:
+        trace.record_cache(cache, hit)
+
+
+# Function to time a stage of the current turn; outside of a traced turn it only yields the attributes
+@contextmanager
+def span(stage: str, **attributes):
+    trace = _current.get()
+    if trace is None:
+        yield attributes
+        return
+    with trace.span(stage, **attributes) as attributes:
+        yield attributes
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Adds the prompt and completion tokens, and the cost, of each LLM call to the trace.
+
+    The stage is taken from the ``sqlbot:<stage>`` tag of the chain making the call. Token
+    counts come from the provider's usage data when present and are estimated otherwise.
+    """
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        from text_index import estimate_tokens
+
+        stage = next((tag.split(":", 1)[1] for tag in tags or [] if tag.startswith("sqlbot:")), "llm")
+        prompt = "\n".join(str(m.content) for batch in messages for m in batch)
+        params = kwargs.get("invocation_params") or {}
+        model = str(params.get("model_name") or params.get("model") or "")
+        self._runs[run_id] = (stage, model, estimate_tokens(prompt))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        from text_index import estimate_tokens
+
+        stage, model, estimated_prompt = self._runs.pop(run_id, ("llm", "", 0))
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        message_usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        prompt_tokens = usage.get("prompt_tokens") or message_usage.get("input_tokens") or estimated_prompt
+        completion_tokens = (usage.get("completion_tokens") or message_usage.get("output_tokens")
+                             or estimate_tokens(generation.text if generation else ""))
+        cost = llm_cost(model, prompt_tokens, completion_tokens)
+        self.trace.add(stage, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=cost)
+        metrics.inc("sqlbot_llm_tokens_total", prompt_tokens, stage=stage, kind="prompt")
+        metrics.inc("sqlbot_llm_tokens_total", completion_tokens, stage=stage, kind="completion")
+        metrics.inc("sqlbot_llm_cost_dollars_total", cost, stage=stage, model=model or "unknown")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Function to serve /metrics on localhost once per process (port 0 disables it)
+def start_metrics_server(port: int = METRICS_PORT):
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        except OSError as error:
+            logger.warning("metrics endpoint not started on port %s: %s", port, error)
+            return None
+        threading.Thread(target=_server.serve_forever, name="sqlbot-metrics", daemon=True).start()
+        return _server
+
+
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
@@ -0,0 +1,212 @@
+"""Website ingestion: crawl a site, cache it on disk, and index it for retrieval.
+
+``ingest_website`` fetches the start URL and the same-site pages it links to (up to
+``MAX_PAGES``, ``MAX_DEPTH`` links away) concurrently, with a cap on requests in flight
+and a timeout per request. Responses are kept in an on-disk HTTP cache and revalidated
+with ``If-None-Match``/``If-Modified-Since``, so connecting again only downloads pages
+that changed. Page text is split into chunks and indexed with BM25; the answer prompt
+only gets the few chunks most relevant to the question (``WebIndex.context``).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import httpx
+from bs4 import BeautifulSoup
+
+from pipeline import get_async_http_client
+from sql_cache import CACHE_DIR
+from text_index import BM25Index, estimate_tokens
+
+
+MAX_PAGES = int(os.getenv("SQLBOT_WEB_MAX_PAGES", "20"))
+MAX_DEPTH = int(os.getenv("SQLBOT_WEB_MAX_DEPTH", "1"))
+CONCURRENCY = int(os.getenv("SQLBOT_WEB_CONCURRENCY", "4"))
+FETCH_TIMEOUT = float(os.getenv("SQLBOT_WEB_TIMEOUT", "10"))
+CHUNK_TOKENS = 200
+TOP_K = 3
+# How long an ingested site is reused as is before it is revalidated against the server
+INDEX_MAX_AGE = 600
+
+_TEXT_TAGS = ["h1", "h2", "h3", "h4", "p", "li", "td", "pre"]
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+logger = logging.getLogger(__name__)
+_indexes = {}
+_lock = threading.Lock()
+
+
+class HTTPCache:
+    """Response bodies on disk, with the validators needed for conditional requests."""
+
+    def __init__(self, directory: str = os.path.join(CACHE_DIR, "http")):
+        self.directory = directory
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def load(self, url: str) -> dict:
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, url: str, response: httpx.Response) -> dict:
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type", ""),
+            "text": response.text,
+            "fetched_at": time.time(),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(url)
+        # Written aside and renamed, so a reader never sees half a file
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+        return entry
+
+
+# Function to fetch a page through the HTTP cache; returns the cache entry, or None when it can't be had
+async def fetch(client: httpx.AsyncClient, cache: HTTPCache, url: str, timeout: float = FETCH_TIMEOUT) -> dict:
+    entry = await asyncio.to_thread(cache.load, url)
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        response = await client.get(url, headers=headers, timeout=timeout, follow_redirects=True)
+    except httpx.HTTPError as error:
+        logger.warning("could not fetch %s: %s", url, error)
+        # A stale copy is better than nothing
+        return entry
+    if response.status_code == 304 and entry is not None:
+        return entry
+    if response.status_code != 200:
+        logger.warning("could not fetch %s: HTTP %s", url, response.status_code)
+        return None
+    return await asyncio.to_thread(cache.store, url, response)
+
+
+# Function to pull the title, text blocks and links out of an HTML page
+def parse_page(url: str, html: str) -> dict:
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "nav", "footer"]):
+        tag.decompose()
+    blocks = []
+    for element in soup.find_all(_TEXT_TAGS):
+        # A list item or cell holding paragraphs is covered by those paragraphs
+        if element.name in ("li", "td") and element.find(["p", "li", "td"]):
+            continue
+        block = element.get_text(" ", strip=True)
+        if block:
+            blocks.append(block)
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = urldefrag(urljoin(url, anchor["href"]))[0]
+        if urlparse(link).scheme in ("http", "https"):
+            links.append(link)
+    title = soup.title.get_text(strip=True) if soup.title else url
+    return {"url": url, "title": title, "blocks": blocks, "links": links}
+
+
+# Function to group a page's text blocks into chunks of about max_tokens tokens
+def chunk_blocks(blocks: list, max_tokens: int = CHUNK_TOKENS) -> list:
+    pieces = []
+    for block in blocks:
+        if estimate_tokens(block) <= max_tokens:
+            pieces.append(block)
+        else:
+            # Split long blocks between sentences
+            pieces.extend(sentence for sentence in _SENTENCE_RE.split(block) if sentence)
+    chunks, current = [], []
+    for piece in pieces:
+        if current and estimate_tokens(" ".join(current + [piece])) > max_tokens:
+            chunks.append(" ".join(current))
+            current = []
+        current.append(piece)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class WebIndex:
+    """BM25 index over the text chunks of the crawled pages."""
+
+    def __init__(self, url: str, chunks: list, pages: int):
+        self.url = url
+        self.chunks = chunks
+        self.pages = pages
+        self.created_at = time.monotonic()
+        self._index = BM25Index([f"{chunk['title']} {chunk['text']}" for chunk in chunks])
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query: str, k: int = TOP_K) -> list:
+        return [self.chunks[i] for i, _ in self._index.search(query, k)]
+
+    def context(self, query: str, k: int = TOP_K) -> str:
+        """The top-k chunks for a question, formatted for the answer prompt."""
+        return "\n\n".join(f"[{chunk['url']}] {chunk['text']}" for chunk in self.search(query, k))
+
+
+# Function to crawl a site from a URL (same host only) and return the parsed pages
+async def crawl(url: str, max_pages: int = MAX_PAGES, max_depth: int = MAX_DEPTH, concurrency: int = CONCURRENCY,
+                timeout: float = FETCH_TIMEOUT, cache: HTTPCache = None, client: httpx.AsyncClient = None) -> list:
+    cache = cache or HTTPCache()
+    client = client or get_async_http_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    host = urlparse(url).netloc
+
+    async def fetch_page(page_url: str):
+        async with semaphore:
+            entry = await fetch(client, cache, page_url, timeout)
+        if entry is None or "html" not in (entry.get("content_type") or "text/html"):
+            return None
+        return await asyncio.to_thread(parse_page, page_url, entry["text"])
+
+    pages, seen, frontier = [], {url}, [url]
+    for depth in range(max_depth + 1):
+        next_frontier = []
+        for page in await asyncio.gather(*(fetch_page(page_url) for page_url in frontier)):
+            if page is None:
+                continue
+            pages.append(page)
+            for link in page["links"]:
+                if urlparse(link).netloc == host and link not in seen and len(seen) < max_pages:
+                    seen.add(link)
+                    next_frontier.append(link)
+        frontier = next_frontier
+        if not frontier or depth == max_depth:
+            break
+    return pages
+
+
+# Function to crawl, chunk and index a website; reuses a recent index of the same URL
+async def ingest_website(url: str, max_age: float = INDEX_MAX_AGE, **crawl_args) -> WebIndex:
+    with _lock:
+        index = _indexes.get(url)
+    if index is not None and time.monotonic() - index.created_at < max_age:
+        return index
+    pages = await crawl(url, **crawl_args)
+    chunks = [
+        {"url": page["url"], "title": page["title"], "text": text}
+        for page in pages
+        for text in chunk_blocks(page["blocks"])
+    ]
+    index = WebIndex(url, chunks, len(pages))
+    with _lock:
+        _indexes[url] = index
+    return index